@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Guards the startup time of the command line paths scripts call in loops,
+`sermon -l` and `sermon -v`. Measures the import time of `sermon.sermon`
+with `python -X importtime` and the wall time of both commands in fresh
+processes, checks that neither imports the interactive interface, and exits
+with status 1 if a limit is exceeded.
+
+    $ python benchmarks/bench_import.py
+    $ python benchmarks/bench_import.py --runs 20 --limit-ms 60
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import subprocess
+import time
+import argparse
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules only the interactive interface, headless mode or --cat need.
+deferred = ('urwid', 'sermon.ui', 'sermon.magics', 'sermon.resources',
+            'sermon.headless', 'sermon.blocklog', 'sermon.bridge')
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def import_times(module):
+    """
+    Imports `module` in a fresh interpreter with -X importtime.
+
+    Returns
+    -------
+    times : dict
+        Cumulative import time in microseconds of every module imported.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import %s' % module],
+                            env=_env(), stderr=subprocess.PIPE, check=True)
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            times[fields[2].strip()] = int(fields[1])
+        except ValueError:
+            # The header line.
+            continue
+    return times
+
+
+def command_time(argv, runs):
+    """
+    Returns the median wall time in seconds of running sermon with `argv`.
+    """
+    code = 'import sys; from sermon.sermon import main; ' \
+           'sys.argv = ["sermon"] + %r; main()' % (argv,)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=_env(),
+                       stdout=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark sermon startup time.')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Processes started per command, the median '
+                             'is reported.')
+    parser.add_argument('--limit-ms', type=float, default=100,
+                        help='Fail if importing sermon.sermon takes longer.')
+    parser.add_argument('--output', default=None,
+                        help='Write the JSON report to this file.')
+    opts = parser.parse_args()
+
+    times = import_times('sermon.sermon')
+    imported = [name for name in deferred if name in times]
+    baseline = command_time(['-v'], opts.runs) if opts.runs > 0 else None
+    report = {
+        'import_ms': round(times['sermon.sermon'] / 1000, 3),
+        'slowest_imports_ms': dict(
+            (name, round(us / 1000, 3)) for name, us in
+            sorted(times.items(), key=lambda item: -item[1])[1:6]),
+        'deferred_imported': imported,
+        'version_ms': (round(1000 * baseline, 3)
+                       if baseline is not None else None),
+        'list_ms': (round(1000 * command_time(['-l'], opts.runs), 3)
+                    if opts.runs > 0 else None),
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if opts.output is not None:
+        with open(opts.output, 'w') as f:
+            f.write(text + '\n')
+
+    failed = False
+    if len(imported) > 0:
+        print('Imported at startup: %s' % ', '.join(imported),
+              file=sys.stderr)
+        failed = True
+    if report['import_ms'] > opts.limit_ms:
+        print('Importing sermon.sermon took %.1f ms, limit %.1f ms.' %
+              (report['import_ms'], opts.limit_ms), file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compares the throughput of the old byte-at-a-time serial read loop with
+`sermon.util.read_available`. Data is pushed through a local pseudo-terminal
+pair and every chunk read is forwarded to a pipe, as `Sermon` does with its
+urwid watch pipe.
+
+    $ python benchmarks/bench_read.py --size 2000000
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import threading
+import time
+import tty
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import serial
+
+import sermon.util as util
+
+
+def byte_reader(ser, size):
+    """
+    The read loop used before bulk reads, one byte per call.
+    """
+    return ser.read()
+
+
+def bulk_reader(ser, size):
+    return util.read_available(ser, size)
+
+
+def drain(fd):
+    while True:
+        if not os.read(fd, 65536):
+            return
+
+
+def run(reader, total, chunk):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    ser = serial.Serial(os.ttyname(slave), timeout=0.1)
+    pipe_r, pipe_w = os.pipe()
+    drainer = threading.Thread(target=drain, args=(pipe_r,))
+    drainer.daemon = True
+    drainer.start()
+
+    def feed():
+        block = b'0123456789abcdef' * 64
+        sent = 0
+        while sent < total:
+            sent += os.write(master, block[:total - sent])
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+
+    received = 0
+    start = time.time()
+    feeder.start()
+    while received < total:
+        data = reader(ser, chunk)
+        if not data and not feeder.is_alive():
+            break
+        received += len(data)
+        os.write(pipe_w, data)
+    elapsed = time.time() - start
+
+    ser.close()
+    for fd in (master, slave, pipe_w):
+        os.close(fd)
+    return received, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark serial read strategies.')
+    parser.add_argument('--size', type=int, default=1000000,
+                        help='Number of bytes to transfer.')
+    parser.add_argument('--read-chunk', type=int, default=4096,
+                        help='Maximum bytes per bulk read.')
+    args = parser.parse_args()
+
+    for name, reader in (('byte', byte_reader), ('bulk', bulk_reader)):
+        received, elapsed = run(reader, args.size, args.read_chunk)
+        print('%-5s %10d bytes  %8.3f s  %12.0f bytes/s' %
+              (name, received, elapsed, received / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end throughput benchmark. Drives `Sermon` (target 'ui') or the
+headless mode (target 'headless') against a local pseudo-terminal pair or
+pyserial's loop:// port, pushing timestamped packets at a configurable rate
+and size distribution. Reports sustained bytes/s, CPU seconds per MB, latency
+percentiles from the device to the display (or stdout) and peak RSS as JSON.
+
+Each scenario runs in its own process so peak RSS and CPU are not shared.
+
+    $ python benchmarks/bench_throughput.py --size 5M --output report.json
+    $ python benchmarks/bench_throughput.py --target ui --transport loop \\
+        --rate 11520 --packet-size 8:120 --log
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import io
+import json
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+import tty
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import sermon.util as util
+
+
+class Collector(object):
+    """
+    Parses received packets and records their latency. Packets are lines of
+    the form b'<send time> <padding>\\n'.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.received = 0
+        self.latencies = []
+        self.finished = threading.Event()
+        self._partial = b''
+
+    def feed(self, data):
+        now = time.monotonic()
+        self.received += len(data)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            try:
+                self.latencies.append(now - float(line.split(b' ', 1)[0]))
+            except ValueError:
+                pass
+        if self.received >= self.total:
+            self.finished.set()
+
+
+def packets(total, min_size, max_size, seed):
+    """
+    Yields packets until `total` bytes have been generated.
+    """
+    rng = random.Random(seed)
+    sent = 0
+    while sent < total:
+        size = min(rng.randint(min_size, max_size), total - sent)
+        yield size
+        sent += size
+
+
+def make_packet(size):
+    stamp = b'%.6f ' % time.monotonic()
+    if size <= len(stamp):
+        return (b'x' * (size - 1) + b'\n') if size > 0 else b''
+    return stamp + b'x' * (size - len(stamp) - 1) + b'\n'
+
+
+def feed(write, opts):
+    """
+    Writes packets with `write`, pacing them to `opts.rate` bytes per second
+    if given.
+    """
+    start = time.monotonic()
+    sent = 0
+    for size in packets(opts.size, opts.min_packet, opts.max_packet,
+                        opts.seed):
+        if opts.rate > 0:
+            delay = start + sent / opts.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        data = make_packet(size)
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[write(view):]
+        sent += size
+
+
+def open_transport(transport):
+    """
+    Returns the device to open and, for a pty, the master file descriptor
+    the feeder writes to.
+    """
+    if transport == 'loop':
+        return 'loop://', None
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    return os.ttyname(slave), master
+
+
+def run_headless(opts, sermon_args):
+    from sermon.headless import Headless
+
+    device, master = open_transport(opts.transport)
+    null = os.open(os.devnull, os.O_RDONLY)
+    pipe_r, pipe_w = os.pipe()
+    app = Headless(device, sermon_args(device), stdin=null, stdout=pipe_w)
+    collector = Collector(opts.size)
+
+    def collect():
+        while not collector.finished.is_set():
+            collector.feed(os.read(pipe_r, 65536))
+        app.stop_event.set()
+
+    write = (lambda d: os.write(master, d)) if master is not None else \
+        app.serial.write
+    threading.Thread(target=collect, daemon=True).start()
+    threading.Thread(target=feed, args=(write, opts), daemon=True).start()
+    timer = threading.Timer(opts.timeout, app.stop_event.set)
+    timer.daemon = True
+    timer.start()
+    app.run()
+    return collector
+
+
+def run_ui(opts, sermon_args):
+    import urwid
+    try:
+        from urwid.display.raw import Screen
+    except ImportError:
+        from urwid.raw_display import Screen
+    from sermon.ui import Sermon
+
+    device, master = open_transport(opts.transport)
+    app = Sermon(device, sermon_args(device))
+    collector = Collector(opts.size)
+    received_data = app.received_data
+
+    def timed_received_data(data):
+        collector.feed(data)
+        received_data(data)
+
+    app.received_data = timed_received_data
+    if opts.log:
+        from sermon.logger import LogWriter
+        fd, filename = tempfile.mkstemp(prefix='sermon-bench-')
+        os.close(fd)
+        app.logger = LogWriter(filename)
+        app.logging = True
+
+    # Render to a pseudo-terminal nobody looks at.
+    screen_master, screen_slave = os.openpty()
+
+    def drain():
+        try:
+            while os.read(screen_master, 65536):
+                pass
+        except OSError:
+            pass
+
+    app.loop.screen = Screen(
+        input=io.TextIOWrapper(os.fdopen(os.dup(screen_slave), 'rb', 0)),
+        output=io.TextIOWrapper(os.fdopen(os.dup(screen_slave), 'wb', 0),
+                                write_through=True))
+    deadline = time.monotonic() + opts.timeout
+
+    def check(loop, user_data):
+        if collector.finished.is_set() or time.monotonic() > deadline:
+            raise urwid.ExitMainLoop()
+        loop.set_alarm_in(0.05, check)
+
+    write = (lambda d: os.write(master, d)) if master is not None else \
+        app.serial.write
+    threading.Thread(target=drain, daemon=True).start()
+    threading.Thread(target=feed, args=(write, opts), daemon=True).start()
+    app.loop.set_alarm_in(0.05, check)
+    app.worker.start()
+    app.loop.run()
+    app.stop()
+    if opts.log:
+        os.remove(filename)
+    return collector
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run_scenario(opts):
+    """
+    Runs a single scenario in this process and returns its report.
+    """
+    def sermon_args(device):
+        from sermon.sermon import parse_args
+        argv = ['--read-chunk', str(opts.read_chunk), '--fps', str(opts.fps)]
+        if opts.target == 'headless':
+            argv.append('--headless')
+        return parse_args(argv + [device])
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    start = time.monotonic()
+    if opts.target == 'headless':
+        collector = run_headless(opts, sermon_args)
+    else:
+        collector = run_ui(opts, sermon_args)
+    elapsed = time.monotonic() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime - cpu_start
+
+    latencies = collector.latencies
+    return {
+        'target': opts.target,
+        'transport': opts.transport,
+        'log': opts.log,
+        'rate': opts.rate,
+        'packet_size': [opts.min_packet, opts.max_packet],
+        'bytes': collector.received,
+        'complete': collector.received >= opts.size,
+        'seconds': elapsed,
+        'bytes_per_s': collector.received / elapsed,
+        # Includes the feeder thread generating the data.
+        'cpu_s_per_mb': cpu / max(collector.received / 1e6, 1e-9),
+        'latency_ms': {
+            'p50': _ms(percentile(latencies, 50)),
+            'p90': _ms(percentile(latencies, 90)),
+            'p99': _ms(percentile(latencies, 99)),
+            'max': _ms(max(latencies) if latencies else None)},
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(1000 * seconds, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark sermon end to end.')
+    parser.add_argument('--target', choices=['ui', 'headless', 'all'],
+                        default='all')
+    parser.add_argument('--transport', choices=['pty', 'loop', 'all'],
+                        default='all')
+    parser.add_argument('--size', default='2M',
+                        help='Bytes to transfer per scenario.')
+    parser.add_argument('--rate', default='0',
+                        help='Bytes per second to send, 0 for unlimited.')
+    parser.add_argument('--packet-size', default='16:256',
+                        help='MIN:MAX packet size, chosen uniformly.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--read-chunk', type=int, default=4096)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--log', action='store_true',
+                        help='Log received data during ui scenarios.')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', default=None,
+                        help='Write the JSON report to this file.')
+    parser.add_argument('--scenario', action='store_true',
+                        help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+    opts.size = util.parse_size(opts.size)
+    opts.rate = util.parse_size(opts.rate)
+    opts.min_packet, opts.max_packet = [
+        int(n) for n in opts.packet_size.split(':')]
+
+    if opts.scenario:
+        print(json.dumps(run_scenario(opts)))
+        return
+
+    targets = ['headless', 'ui'] if opts.target == 'all' else [opts.target]
+    transports = (['pty', 'loop'] if opts.transport == 'all'
+                  else [opts.transport])
+    argv = sys.argv[1:]
+    reports = []
+    for target in targets:
+        for transport in transports:
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--scenario',
+                 '--target', target, '--transport', transport] +
+                _strip_options(argv, ('--target', '--transport', '--output')))
+            reports.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+    report = json.dumps({'scenarios': reports}, indent=2, sort_keys=True)
+    if opts.output is not None:
+        with open(opts.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+
+
+def _strip_options(argv, names):
+    """
+    Removes options in `names`, and their values, from argv.
+    """
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in names:
+            skip = True
+        elif not any(arg.startswith(name + '=') for name in names):
+            result.append(arg)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compressed logfiles of independent blocks with a time index.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import bisect
+import collections
+import lzma
+import os
+import struct
+import time
+import zlib
+
+from sermon.logger import LogWriter
+
+
+codecs = {'gzip': 1, 'lzma': 2}
+
+# Index header: magic, then the codec.
+index_magic = b'SRMLOGX\x01'
+index_header = struct.Struct('<B')
+# Index entry: offset of the compressed block in the logfile, offset of the
+# data in the uncompressed log and the wall clock time it was logged.
+index_entry = struct.Struct('<QQd')
+
+Mark = collections.namedtuple('Mark', 'offset raw_offset time')
+
+
+def index_filename(filename):
+    return filename + '.idx'
+
+
+def _compressor(codec):
+    if codec == 'lzma':
+        return lzma.LZMACompressor(lzma.FORMAT_XZ)
+    # wbits 31 writes a gzip header and trailer.
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def _decompressor(codec):
+    if codec == 'lzma':
+        return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+    return zlib.decompressobj(31)
+
+
+class BlockLogWriter(LogWriter):
+    """
+    Writes the log compressed, as a sequence of independently compressed
+    blocks of at most `block_size` bytes of data or `block_seconds` seconds.
+    Each block is a complete gzip member or xz stream, so the logfile is an
+    ordinary .gz or .xz file which zcat or xzcat read in full. Compression
+    runs on the `LogWriter` thread, chunk by chunk as they arrive, so logging
+    still only costs the caller a queue put.
+
+    The sidecar index FILE.idx gets a 24 byte entry whenever a block starts
+    and at most every `mark_interval` seconds within one, mapping the wall
+    clock time data was logged to its offset in the uncompressed log and to
+    the block holding it. `BlockLog` uses it to decompress only the blocks
+    for a time range. Rotated files keep their index, e.g. FILE.1.idx.
+    """
+    def __init__(self, filename, compress='gzip', block_size=1048576,
+                 block_seconds=60, mark_interval=1.0, **kwargs):
+        """
+        Parameters
+        ----------
+        filename : str
+            Path of the logfile, truncated if it exists.
+        compress : str
+            'gzip' or 'lzma'.
+        block_size : int
+            Uncompressed bytes after which a block is finished.
+        block_seconds : float
+            Seconds after which a block is finished, so data doesn't stay
+            in the compressor indefinitely on a quiet device.
+        mark_interval : float
+            Minimum number of seconds between index entries within a block.
+        """
+        self.compress = compress
+        self.block_size = block_size
+        self.block_seconds = block_seconds
+        self.mark_interval = mark_interval
+        self.compressed_bytes = 0
+        super(BlockLogWriter, self).__init__(filename, **kwargs)
+
+    def _open(self):
+        super(BlockLogWriter, self)._open()
+        self._index = open(index_filename(self.filename), 'wb')
+        self._index.write(index_magic +
+                          index_header.pack(codecs[self.compress]))
+        self._offset = 0
+        self._raw_offset = 0
+        self._compressor = None
+
+    def _emit(self, data):
+        if len(data) > 0:
+            self._file.write(data)
+            self._offset += len(data)
+            self.compressed_bytes += len(data)
+
+    def _write(self, data):
+        now = time.time()
+        if self._compressor is None:
+            self._compressor = _compressor(self.compress)
+            self._block_offset = self._offset
+            self._block_bytes = 0
+            self._block_started = time.monotonic()
+            self._last_mark = None
+        if self._last_mark is None or \
+                now - self._last_mark >= self.mark_interval:
+            self._index.write(index_entry.pack(self._block_offset,
+                                               self._raw_offset, now))
+            self._last_mark = now
+        self._emit(self._compressor.compress(data))
+        self._raw_offset += len(data)
+        self._block_bytes += len(data)
+        if self._block_bytes >= self.block_size:
+            self._finish_block()
+
+    def _finish_block(self):
+        if self._compressor is not None:
+            self._emit(self._compressor.flush())
+            self._compressor = None
+
+    def _flush(self, complete=False):
+        if complete or (self._compressor is not None and
+                        time.monotonic() - self._block_started >=
+                        self.block_seconds):
+            self._finish_block()
+        self._file.flush()
+        self._index.flush()
+
+    def _close(self):
+        self._finish_block()
+        self._file.close()
+        self._index.close()
+
+    def _rename(self, target):
+        super(BlockLogWriter, self)._rename(target)
+        os.rename(index_filename(self.filename), index_filename(target))
+
+
+class BlockLog(object):
+    """
+    Reads a logfile written by `BlockLogWriter` through its index.
+    """
+    def __init__(self, filename):
+        """
+        Raises
+        ------
+        ValueError
+            If the file or its index can't be read.
+        """
+        self.filename = filename
+        try:
+            with open(index_filename(filename), 'rb') as f:
+                data = f.read()
+            self.size = os.path.getsize(filename)
+            self.modified = os.path.getmtime(filename)
+        except (IOError, OSError):
+            raise ValueError('No index found for %s, was it logged with '
+                             '--compress?' % filename)
+        start = len(index_magic) + index_header.size
+        if not data.startswith(index_magic) or len(data) < start:
+            raise ValueError('Invalid index for %s.' % filename)
+        codec, = index_header.unpack_from(data, len(index_magic))
+        names = dict((v, k) for k, v in codecs.items())
+        if codec not in names:
+            raise ValueError('Unknown compression in %s.' % filename)
+        self.codec = names[codec]
+        # An entry cut short by a crash is ignored.
+        end = start + (len(data) - start) // index_entry.size * \
+            index_entry.size
+        self.marks = [Mark(*entry) for entry in
+                      index_entry.iter_unpack(data[start:end])]
+
+    @property
+    def started(self):
+        """
+        Wall clock time of the first data logged, or None.
+        """
+        return self.marks[0].time if len(self.marks) > 0 else None
+
+    def _range(self, start, end):
+        """
+        Returns the uncompressed offsets [first, last) of the data logged
+        between `start` and `end`, to the precision of the index entries.
+        """
+        times = [mark.time for mark in self.marks]
+        # Data after entry n was logged before entry n + 1, or before the
+        # file was last modified.
+        first = 0
+        if start is not None:
+            n = bisect.bisect_right(times, start) - 1
+            if n >= 0 and (n + 1 < len(times) or start <= self.modified):
+                first = n
+            elif n >= 0:
+                return None
+        last = len(self.marks)
+        if end is not None:
+            last = bisect.bisect_right(times, end)
+        if last <= first:
+            return None
+        raw_first = self.marks[first].raw_offset
+        raw_last = (self.marks[last].raw_offset if last < len(self.marks)
+                    else None)
+        return raw_first, raw_last
+
+    def cat(self, out, start=None, end=None):
+        """
+        Writes the data logged between wall clock times `start` and `end`
+        to the binary file `out`, decompressing only the blocks holding it.
+
+        Returns
+        -------
+        written : int
+            Number of bytes written.
+        """
+        span = self._range(start, end)
+        if span is None:
+            return 0
+        raw_first, raw_last = span
+        blocks = []
+        for mark in self.marks:
+            if len(blocks) == 0 or blocks[-1].offset != mark.offset:
+                blocks.append(mark)
+        written = 0
+        with open(self.filename, 'rb') as f:
+            for n, block in enumerate(blocks):
+                if raw_last is not None and block.raw_offset >= raw_last:
+                    break
+                following = blocks[n + 1] if n + 1 < len(blocks) else None
+                if following is not None and \
+                        following.raw_offset <= raw_first:
+                    continue
+                f.seek(block.offset)
+                size = (following.offset if following is not None
+                        else self.size) - block.offset
+                try:
+                    data = _decompressor(self.codec).decompress(f.read(size))
+                except (zlib.error, lzma.LZMAError, EOFError):
+                    # A block cut short by a crash, skip it.
+                    continue
+                view = memoryview(data)
+                lo = max(0, raw_first - block.raw_offset)
+                hi = len(view)
+                if raw_last is not None:
+                    hi = min(hi, raw_last - block.raw_offset)
+                if hi > lo:
+                    out.write(view[lo:hi])
+                    written += hi - lo
+        return written
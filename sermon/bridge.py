@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shares the serial device with TCP clients.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import fcntl
+import queue
+import selectors
+import socket
+import struct
+import termios
+import threading
+
+from serial.urlhandler import protocol_socket
+
+
+def parse_address(text):
+    """
+    Parses a 'HOST:PORT' address, HOST may be empty to listen on all
+    interfaces.
+
+    Returns
+    -------
+    address : tuple
+        (host, port)
+
+    Raises
+    ------
+    ValueError
+        If the address is malformed.
+    """
+    host, sep, port = text.rpartition(':')
+    if not sep or not port.isdigit() or not 0 <= int(port) < 65536:
+        raise ValueError('Invalid address: %s, expected HOST:PORT.' % text)
+    return host.strip('[]'), int(port)
+
+
+class TCPPort(protocol_socket.Serial):
+    """
+    pyserial's socket:// port, reporting the number of bytes waiting in
+    `in_waiting` rather than just whether any are, so a whole burst is read
+    in a single call.
+    """
+    @property
+    def in_waiting(self):
+        if not self.is_open:
+            return 0
+        waiting = fcntl.ioctl(self._socket.fileno(), termios.FIONREAD,
+                              struct.pack('i', 0))
+        return struct.unpack('i', waiting)[0]
+
+    def fileno(self):
+        return self._socket.fileno()
+
+
+class _Client(object):
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.chunks = collections.deque()
+        self.queued = 0
+        self.offset = 0
+        self.inbound = None
+        self.overflow = False
+        self.events = selectors.EVENT_READ
+
+
+class TCPBridge(object):
+    """
+    Serves the serial device to any number of TCP clients from a single
+    selectors loop on its own thread. Every received chunk is queued for
+    every client, and each client has a bounded queue: a client which falls
+    more than `max_queue` bytes behind is disconnected, so a stalled client
+    never slows down the reader or the other clients.
+
+    Data sent by clients is passed to `on_receive`, which queues it on the
+    single outbound path and raises `queue.Full` when that is full. Reading
+    from the client then pauses until the data is accepted, so TCP flow
+    control pushes back on the client instead of data being dropped.
+    """
+    def __init__(self, address, on_receive, max_queue=1048576):
+        """
+        Parameters
+        ----------
+        address : tuple
+            (host, port) to listen on, port 0 picks a free port.
+        on_receive : callable
+            Called with the bytes received from a client.
+        max_queue : int
+            Maximum number of bytes queued for a client.
+
+        Raises
+        ------
+        OSError
+            If the address can't be bound.
+        """
+        self.on_receive = on_receive
+        self.max_queue = max_queue
+        self.clients = []
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+        self._server = socket.create_server(address, family=family)
+        self._server.setblocking(False)
+        self.address = self._server.getsockname()[:2]
+        self._lock = threading.Lock()
+        self._woken = False
+        self._stop = False
+        self._stalled = []
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def broadcast(self, data):
+        """
+        Queues received data for every client. Called from the reader
+        thread, never blocks.
+        """
+        with self._lock:
+            if len(self.clients) == 0:
+                return
+            for client in self.clients:
+                if client.queued + len(data) > self.max_queue:
+                    client.overflow = True
+                else:
+                    client.chunks.append(data)
+                    client.queued += len(data)
+            wake = not self._woken
+            self._woken = True
+        if wake:
+            self._wake()
+
+    def close(self):
+        """
+        Disconnects all clients and stops listening.
+        """
+        self._stop = True
+        self._wake()
+        self._thread.join()
+
+    def status_str(self):
+        """
+        Short description for the status bar.
+        """
+        return '%d client%s' % (len(self.clients),
+                                '' if len(self.clients) == 1 else 's')
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'.')
+        except OSError:
+            pass
+
+    def _run(self):
+        try:
+            while not self._stop:
+                timeout = 0.05 if len(self._stalled) > 0 else None
+                for key, events in self._selector.select(timeout):
+                    if key.fileobj is self._server:
+                        self._accept()
+                    elif key.fileobj is self._wake_r:
+                        self._drain_wake()
+                    else:
+                        if events & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if events & selectors.EVENT_WRITE and \
+                                key.data in self.clients:
+                            self._write(key.data)
+                self._retry_stalled()
+        finally:
+            for client in list(self.clients):
+                self._disconnect(client)
+            self._selector.close()
+            self._server.close()
+            self._wake_r.close()
+            self._wake_w.close()
+
+    def _accept(self):
+        try:
+            sock, address = self._server.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        client = _Client(sock, address)
+        self._selector.register(sock, client.events, client)
+        with self._lock:
+            self.clients = self.clients + [client]
+
+    def _disconnect(self, client):
+        with self._lock:
+            self.clients = [c for c in self.clients if c is not client]
+        if client in self._stalled:
+            self._stalled.remove(client)
+        self._set_events(client, 0)
+        client.sock.close()
+
+    def _set_events(self, client, events):
+        if events == client.events:
+            return
+        # Selectors can't watch a socket for nothing, unregister it instead.
+        if client.events == 0:
+            self._selector.register(client.sock, events, client)
+        elif events == 0:
+            self._selector.unregister(client.sock)
+        else:
+            self._selector.modify(client.sock, events, client)
+        client.events = events
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except OSError:
+            pass
+        with self._lock:
+            self._woken = False
+            clients = self.clients
+        for client in clients:
+            if client.overflow:
+                self.dropped += 1
+                self._disconnect(client)
+            elif client.queued > 0:
+                self._set_events(client, client.events | selectors.EVENT_WRITE)
+
+    def _write(self, client):
+        while True:
+            with self._lock:
+                if len(client.chunks) == 0:
+                    break
+                chunk = client.chunks[0]
+            view = memoryview(chunk)[client.offset:]
+            try:
+                sent = client.sock.send(view)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self._disconnect(client)
+                return
+            self.bytes_sent += sent
+            with self._lock:
+                client.queued -= sent
+                if sent < len(view):
+                    client.offset += sent
+                    return
+                client.chunks.popleft()
+                client.offset = 0
+        self._set_events(client, client.events & ~selectors.EVENT_WRITE)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if len(data) == 0:
+            self._disconnect(client)
+            return
+        self.bytes_received += len(data)
+        client.inbound = data
+        self._forward(client)
+
+    def _forward(self, client):
+        """
+        Passes the client's pending data on, pausing reads while the
+        outbound path is full.
+        """
+        try:
+            self.on_receive(client.inbound)
+        except queue.Full:
+            if client not in self._stalled:
+                self._stalled.append(client)
+                self._set_events(client,
+                                 client.events & ~selectors.EVENT_READ)
+            return
+        client.inbound = None
+        if client in self._stalled:
+            self._stalled.remove(client)
+            self._set_events(client, client.events | selectors.EVENT_READ)
+
+    def _retry_stalled(self):
+        for client in list(self._stalled):
+            self._forward(client)
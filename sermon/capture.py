@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timestamped captures of serial traffic and their replay.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import struct
+import threading
+import time
+
+from sermon.logger import LogWriter
+
+RX = 0
+TX = 1
+
+# File header: magic, then the wall clock time the capture started.
+magic = b'SRMCAP\x00\x01'
+file_header = struct.Struct('<d')
+# Record header: nanoseconds since the capture started, direction and length
+# of the data that follows.
+record_header = struct.Struct('<QBI')
+
+
+class CaptureWriter(LogWriter):
+    """
+    Appends every chunk received from or sent to the device to a capture
+    file as a length-prefixed record with a monotonic timestamp and its
+    direction. Records are written by the `LogWriter` thread, so recording a
+    chunk costs a struct pack and a queue put.
+    """
+    def __init__(self, filename, **kwargs):
+        """
+        Parameters
+        ----------
+        filename : str
+            Path of the capture file, truncated if it exists.
+        """
+        self.started = time.monotonic()
+        self.started_wall = time.time()
+        super(CaptureWriter, self).__init__(filename, **kwargs)
+
+    def _open(self):
+        super(CaptureWriter, self)._open()
+        self._file.write(magic + file_header.pack(self.started_wall))
+
+    def record(self, direction, data, timestamp=None):
+        """
+        Queues a record.
+
+        Parameters
+        ----------
+        direction : int
+            RX or TX.
+        data : bytes
+            The chunk.
+        timestamp : float or None
+            `time.monotonic()` when the chunk was read or written, defaults
+            to now.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        nanoseconds = max(0, int((timestamp - self.started) * 1e9))
+        self.write(record_header.pack(nanoseconds, direction, len(data)) +
+                   data)
+
+
+def read_capture(filename):
+    """
+    Iterates over the records of a capture file. A record cut short at the
+    end of the file, e.g. by a crash while capturing, is ignored.
+
+    Yields
+    ------
+    seconds : float
+        Time since the capture started.
+    direction : int
+        RX or TX.
+    data : bytes
+        The chunk.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a capture.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(magic)) != magic or \
+                len(f.read(file_header.size)) != file_header.size:
+            raise ValueError('%s is not a sermon capture.' % filename)
+        while True:
+            header = f.read(record_header.size)
+            if len(header) < record_header.size:
+                return
+            nanoseconds, direction, length = record_header.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield nanoseconds / 1e9, direction, data
+
+
+class ReplayPort(object):
+    """
+    A read-only stand-in for `serial.Serial` returning the received chunks of
+    a capture, either with their original timing scaled by `speed` or, with
+    a speed of 0, as fast as they are read. Writes are discarded. Once the
+    capture is exhausted reads time out like an idle port.
+    """
+    def __init__(self, filename, speed=1.0, timeout=0.1, max_pending=65536):
+        """
+        Parameters
+        ----------
+        filename : str
+            Path of the capture file.
+        speed : float
+            Replay speed relative to the original timing, 0 for as fast as
+            possible.
+        timeout : float
+            Read timeout in seconds.
+        max_pending : int
+            Number of bytes read ahead when replaying as fast as possible.
+        """
+        self.name = filename
+        self.speed = speed
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.is_open = True
+        self.done = False
+        self._records = (
+            (seconds, data) for seconds, direction, data
+            in read_capture(filename) if direction == RX)
+        self._next = None
+        self._start = None
+        self._pending = bytearray()
+        self._cancel = threading.Event()
+        # Fail on a bad file here rather than on the first read.
+        self._advance()
+
+    def _advance(self):
+        """
+        Moves records which are due into the pending data.
+
+        Returns
+        -------
+        delay : float or None
+            Seconds until the next record is due, None at the end of the
+            capture.
+        """
+        while len(self._pending) < self.max_pending:
+            if self._next is None:
+                try:
+                    self._next = next(self._records)
+                except StopIteration:
+                    self.done = True
+                    return None
+            seconds, data = self._next
+            if self.speed > 0:
+                now = time.monotonic()
+                if self._start is None:
+                    self._start = now - seconds / self.speed
+                delay = self._start + seconds / self.speed - now
+                if delay > 0:
+                    return delay
+            self._pending += data
+            self._next = None
+        return 0
+
+    @property
+    def in_waiting(self):
+        self._advance()
+        return len(self._pending)
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        while len(self._pending) == 0:
+            delay = self._advance()
+            if len(self._pending) > 0:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if delay is not None:
+                remaining = min(delay, remaining)
+            if self._cancel.wait(remaining):
+                self._cancel.clear()
+                break
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        return data
+
+    def write(self, data):
+        return len(data)
+
+    def cancel_read(self):
+        self._cancel.set()
+
+    def flushInput(self):
+        # The capture is the only input, nothing stale to discard.
+        pass
+
+    reset_input_buffer = flushInput
+
+    def close(self):
+        self.is_open = False
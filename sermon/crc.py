@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+Table driven CRC checksums used by the framing protocols.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import binascii
+import zlib
+
+
+def _reflect(value, width):
+    result = 0
+    for n in range(width):
+        if value & (1 << n):
+            result |= 1 << (width - 1 - n)
+    return result
+
+
+class CRC(object):
+    """
+    A CRC of up to 32 bits computed a byte at a time from a 256 entry lookup
+    table. The checksum is appended to frames in `byteorder`.
+    """
+    def __init__(self, name, width, poly, init, reflected, xorout, byteorder):
+        """
+        Parameters
+        ----------
+        name : str
+            Name used on the command line.
+        width : int
+            Number of bits, a multiple of 8.
+        poly : int
+            The generator polynomial, not reflected.
+        init : int
+            Initial register value.
+        reflected : bool
+            True if input bytes and the result are bit reversed.
+        xorout : int
+            Value xored into the final register.
+        byteorder : str
+            'big' or 'little', the order the checksum is sent in.
+        """
+        self.name = name
+        self.width = width
+        self.size = width // 8
+        self.init = init
+        self.reflected = reflected
+        self.xorout = xorout
+        self.byteorder = byteorder
+        mask = (1 << width) - 1
+        self.table = []
+        if reflected:
+            rpoly = _reflect(poly, width)
+            for n in range(256):
+                crc = n
+                for _ in range(8):
+                    crc = (crc >> 1) ^ rpoly if crc & 1 else crc >> 1
+                self.table.append(crc)
+        else:
+            top = 1 << (width - 1)
+            for n in range(256):
+                crc = n << (width - 8)
+                for _ in range(8):
+                    crc = ((crc << 1) ^ poly) & mask if crc & top else \
+                        (crc << 1) & mask
+                self.table.append(crc)
+
+    def compute(self, data):
+        """
+        Returns the checksum of data as an integer.
+        """
+        table = self.table
+        crc = self.init
+        if self.reflected:
+            for b in bytearray(data):
+                crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+        else:
+            shift = self.width - 8
+            mask = (1 << self.width) - 1
+            for b in bytearray(data):
+                crc = ((crc << 8) & mask) ^ table[((crc >> shift) ^ b) & 0xFF]
+        return crc ^ self.xorout
+
+    def digest(self, data):
+        """
+        Returns the checksum of data as bytes, in the order it is sent.
+        """
+        crc = self.compute(data)
+        return bytes(bytearray((crc >> (8 * n)) & 0xFF
+                               for n in _order(self.size, self.byteorder)))
+
+    def append(self, data):
+        """
+        Returns data followed by its checksum.
+        """
+        return bytes(data) + self.digest(data)
+
+    def check(self, frame):
+        """
+        Splits the checksum off the end of a received frame and verifies it.
+
+        Returns
+        -------
+        payload : bytes
+            The frame without its checksum.
+        ok : bool
+            True if the checksum matched.
+        """
+        if len(frame) < self.size:
+            return bytes(frame), False
+        payload = frame[:len(frame) - self.size]
+        return bytes(payload), self.digest(payload) == bytes(frame[-self.size:])
+
+
+class CRC32(CRC):
+    """
+    CRC-32 as used by Ethernet and zip, computed by zlib's table driven
+    implementation.
+    """
+    def __init__(self):
+        super(CRC32, self).__init__('crc32', 32, 0x04C11DB7, 0xFFFFFFFF,
+                                    True, 0xFFFFFFFF, 'little')
+
+    def compute(self, data):
+        return zlib.crc32(bytes(data)) & 0xFFFFFFFF
+
+
+class CRC16CCITT(CRC):
+    """
+    CRC-16/CCITT-FALSE computed by binascii's table driven implementation.
+    """
+    def __init__(self):
+        super(CRC16CCITT, self).__init__('crc16-ccitt', 16, 0x1021, 0xFFFF,
+                                         False, 0, 'big')
+
+    def compute(self, data):
+        return binascii.crc_hqx(bytes(data), 0xFFFF)
+
+
+def _order(size, byteorder):
+    if byteorder == 'big':
+        return range(size - 1, -1, -1)
+    return range(size)
+
+
+crcs = {
+    # CRC-16/CCITT-FALSE, sent most significant byte first.
+    'crc16-ccitt': CRC16CCITT(),
+    # CRC-16/X.25, the frame check sequence used by HDLC and PPP.
+    'crc16-x25': CRC('crc16-x25', 16, 0x1021, 0xFFFF, True, 0xFFFF,
+                     'little'),
+    'crc32': CRC32(),
+}
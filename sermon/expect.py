@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+"""
+Waits for received lines matching a pattern and measures response times.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import math
+import os
+import re
+import shlex
+import threading
+import time
+
+import sermon.util as util
+from sermon.util import ThrowingArgumentParser
+
+
+# A script step. Sends `command` (bytes or None), then waits up to `timeout`
+# seconds for a line matching `pattern` unless it is None, or just sleeps
+# for `timeout` seconds when neither is given.
+Step = collections.namedtuple('Step', 'command pattern timeout line')
+
+
+class LineMatcher(object):
+    """
+    Matches a regular expression against received data one line at a time.
+    Complete lines are scanned once, only the unfinished last line is kept
+    and scanned again as it grows, so a match split across chunks is found
+    without rescanning earlier data. The unfinished line is also matched so
+    prompts without a line ending can be waited for.
+    """
+    def __init__(self, pattern, max_line=4096):
+        """
+        Parameters
+        ----------
+        pattern : str
+            The regular expression, matched anywhere in a line.
+        max_line : int
+            Number of bytes of an unfinished line kept for matching.
+
+        Raises
+        ------
+        ValueError
+            If the pattern is not a valid regular expression.
+        """
+        try:
+            self.regex = re.compile(pattern.encode('latin1'))
+        except (re.error, UnicodeEncodeError) as e:
+            raise ValueError('Invalid pattern: %s' % e)
+        self.pattern = pattern
+        self.max_line = max_line
+        self.pending = b''
+
+    def feed(self, data):
+        """
+        Returns the first line completed or extended by data which matches,
+        or None.
+        """
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()[-self.max_line:]
+        search = self.regex.search
+        for line in lines:
+            line = line.rstrip(b'\r')
+            if search(line):
+                return line
+        if search(self.pending):
+            line = self.pending
+            self.pending = b''
+            return line
+        return None
+
+
+class Expecter(object):
+    """
+    Hooked into the receive path, `feed` is called by the reader with every
+    chunk and its read time. At most one pattern is waited for at a time;
+    while none is, feeding costs a single attribute check. Round trip times
+    are measured from the last `mark_sent` to the read time of the chunk
+    completing the matching line, and kept in `latencies` for the session.
+    """
+    def __init__(self):
+        self.sent = None
+        self.unanswered = None
+        self.latencies = []
+        self.matched = None
+        self._settled = 0
+        self._matcher = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def armed(self):
+        return self._matcher is not None
+
+    def arm(self, pattern):
+        """
+        Starts matching received data against `pattern`. Data received
+        before this call is never matched. Sets `unanswered` to the time
+        the last command was sent if that was after the previous pattern
+        was armed or matched, otherwise to None.
+
+        Raises
+        ------
+        ValueError
+            If the pattern is not a valid regular expression.
+        """
+        matcher = LineMatcher(pattern)
+        now = time.monotonic()
+        with self._lock:
+            sent = self.sent
+            self.unanswered = (sent if sent is not None and
+                               sent > self._settled else None)
+            self._settled = now
+            self.matched = None
+            self._done.clear()
+            self._matcher = matcher
+
+    def mark_sent(self):
+        """
+        Records that a command was just queued to be sent.
+        """
+        self.sent = time.monotonic()
+
+    def disarm(self):
+        """
+        Stops matching and wakes any thread waiting in `wait`.
+        """
+        with self._lock:
+            self._matcher = None
+            self._done.set()
+
+    def feed(self, data, timestamp):
+        """
+        Called from the reader thread for every received chunk.
+        """
+        if self._matcher is None:
+            return
+        with self._lock:
+            if self._matcher is None:
+                return
+            line = self._matcher.feed(data)
+            if line is None:
+                return
+            self._matcher = None
+            self.matched = (line, timestamp)
+            self._settled = timestamp
+            self._done.set()
+
+    def wait(self, timeout):
+        """
+        Waits for the armed pattern to match.
+
+        Returns
+        -------
+        matched : tuple or None
+            (line, read time) of the matching line, or None if the timeout
+            expired or `disarm` was called first.
+        """
+        self._done.wait(timeout)
+        with self._lock:
+            self._matcher = None
+            return self.matched
+
+
+def latency_summary(latencies):
+    """
+    Returns the minimum, median and 99th percentile of a list of round trip
+    times, or None if it is empty.
+    """
+    if len(latencies) == 0:
+        return None
+    ordered = sorted(latencies)
+    n = len(ordered)
+    median = (ordered[(n - 1) // 2] + ordered[n // 2]) / 2
+    p99 = ordered[int(math.ceil(0.99 * n)) - 1]
+    return ordered[0], median, p99
+
+
+def latency_str(latencies):
+    """
+    Formats the round trip summary of a list of times, e.g. for %stats.
+    """
+    summary = latency_summary(latencies)
+    if summary is None:
+        return 'none'
+    return '%d, min %.2f ms, median %.2f ms, p99 %.2f ms' % (
+        (len(latencies),) + tuple(1000 * t for t in summary))
+
+
+def step_parser(name):
+    """
+    Returns the argument parser for the %expect, %sendexpect or %sleep
+    command.
+    """
+    parser = ThrowingArgumentParser(prog='%' + name)
+    if name == 'sendexpect':
+        parser.add_argument('command', type=str)
+    if name in ('expect', 'sendexpect'):
+        parser.add_argument('pattern', type=str)
+        parser.add_argument('--timeout', type=str, default='5')
+    else:
+        parser.add_argument('duration', type=str)
+    return parser
+
+
+def parse_step(name, args, encoder, line=None):
+    """
+    Builds the step for an %expect, %sendexpect or %sleep command from its
+    arguments.
+
+    Raises
+    ------
+    ValueError, util.ArgumentParseError
+        If the arguments, pattern or command are invalid.
+    """
+    args = step_parser(name).parse_args(args)
+    if name == 'sleep':
+        return Step(None, None, util.parse_duration(args.duration), line)
+    # Compile once here so an invalid pattern is reported up front.
+    LineMatcher(args.pattern)
+    command = None
+    if name == 'sendexpect':
+        command = encoder.encode(args.command)
+    return Step(command, args.pattern, util.parse_duration(args.timeout),
+                line)
+
+
+def read_script(filename, encoder):
+    """
+    Reads a script file. Every line is sent like text typed at the prompt,
+    except for blank lines, comments starting with # and the %expect,
+    %sendexpect and %sleep commands. Commands are encoded up front, so a
+    script is checked completely before anything is sent.
+
+    Raises
+    ------
+    ValueError
+        If the file can't be read or a line is invalid.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            text = f.read().decode('latin1')
+    except (IOError, OSError):
+        raise ValueError('Unable to read file.')
+    steps = []
+    for n, line in enumerate(text.splitlines(), 1):
+        if len(line.strip()) == 0 or line.lstrip().startswith('#'):
+            continue
+        try:
+            if line.startswith('%'):
+                words = shlex.split(line[1:])
+                if len(words) == 0:
+                    raise ValueError('Missing command after %.')
+                if words[0] not in ('expect', 'sendexpect', 'sleep'):
+                    raise ValueError("Command '%s' can't be used in a "
+                                     "script." % words[0])
+                steps.append(parse_step(words[0], words[1:], encoder, n))
+            else:
+                steps.append(Step(encoder.encode(line), None, None, n))
+        except (util.ArgumentParseError, ValueError) as e:
+            raise ValueError('%s line %d: %s' % (os.path.basename(filename),
+                                                 n, e))
+    return steps
+
+
+class ExpectScript(object):
+    """
+    Runs steps on a background thread: sends commands through a
+    `SerialWriter` and waits for the replies through an `Expecter`. Each
+    %sendexpect arms its pattern before the command is queued, so a fast
+    reply is never missed, and its round trip time is the time from queueing
+    the command to reading the end of the reply. The run stops at the first
+    step that times out.
+    """
+    def __init__(self, steps, expecter, writer, name):
+        """
+        Parameters
+        ----------
+        steps : list of Step
+            The steps to run.
+        expecter : Expecter
+            The expecter fed by the receive path.
+        writer : SerialWriter
+            The writer commands are queued on.
+        name : str
+            Shown in the status bar, e.g. the script's filename.
+        """
+        self.steps = steps
+        self.expecter = expecter
+        self.writer = writer
+        self.name = name
+        self.latencies = []
+        self.position = 0
+        self.failed = None
+        self.cancelled = False
+        self.matched = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        """
+        Starts running in the background.
+        """
+        self._thread.start()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    def cancel(self):
+        """
+        Stops the run, dropping a command of the current step which hasn't
+        been sent yet.
+        """
+        self.cancelled = True
+        self._cancel.set()
+        self.expecter.disarm()
+        self._thread.join()
+
+    def progress_str(self):
+        """
+        Short progress readout for the status bar.
+        """
+        if len(self.steps) == 1:
+            return 'expecting %s' % self.steps[0].pattern
+        return '%s step %d/%d' % (self.name, self.position, len(self.steps))
+
+    def status_str(self):
+        """
+        Summary shown once the run has ended.
+        """
+        if self.cancelled:
+            return 'Cancelled %s at step %d.' % (self.name, self.position)
+        if self.failed is not None:
+            where = ''
+            if self.failed.line is not None:
+                where = ' (line %d)' % self.failed.line
+            return 'Timed out waiting for %s%s.' % (self.failed.pattern,
+                                                    where)
+        if len(self.steps) == 1 and self.matched is not None:
+            line, latency = self.matched
+            return 'Matched %s in %.2f ms.' % (line.decode('latin1'),
+                                               1000 * latency)
+        return '%s done, round trips %s.' % (self.name,
+                                            latency_str(self.latencies))
+
+    def _run(self):
+        try:
+            for step in self.steps:
+                if self._cancel.is_set():
+                    return
+                self.position += 1
+                if step.pattern is not None:
+                    self.expecter.arm(step.pattern)
+                    if self._cancel.is_set():
+                        return
+                if step.command is not None:
+                    self.writer.write(step.command, cancel=self._cancel)
+                    self.expecter.mark_sent()
+                if step.pattern is None:
+                    if step.command is None:
+                        self._cancel.wait(step.timeout)
+                    continue
+                if step.command is not None:
+                    sent = self.expecter.sent
+                else:
+                    # %expect times the reply to a command sent from the
+                    # prompt since the last pattern was armed or matched.
+                    sent = self.expecter.unanswered
+                armed = time.monotonic()
+                matched = self.expecter.wait(step.timeout)
+                if matched is None:
+                    if not self._cancel.is_set():
+                        self.failed = step
+                    return
+                line, timestamp = matched
+                if sent is not None:
+                    latency = timestamp - sent
+                    self.latencies.append(latency)
+                    self.expecter.latencies.append(latency)
+                else:
+                    # Not a round trip, only the time waited is shown.
+                    latency = timestamp - armed
+                self.matched = (line, latency)
+        finally:
+            self.finished = time.monotonic()
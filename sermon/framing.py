@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming decoders splitting received bytes into protocol frames, and
+encoders building the frames sent to the device.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+from sermon.hexdump import hex_table
+
+# Printable ASCII as is, everything else as \xNN.
+escape_table = [chr(n) if 32 <= n < 127 and n != 92 else '\\x%02x' % n
+                for n in range(256)]
+escape_table[92] = '\\\\'
+
+
+def format_frame(frame, error=None, hex_mode=False):
+    """
+    Formats a decoded frame as a single display line.
+
+    Parameters
+    ----------
+    frame : bytes
+        The frame payload.
+    error : str or None
+        Decode error of the frame, if any.
+    hex_mode : bool
+        Show the payload as hex bytes instead of escaped text.
+    """
+    table = hex_table if hex_mode else escape_table
+    text = ''.join([table[b] for b in bytearray(frame)]).rstrip(' ')
+    if error is not None:
+        return '[%s] %s' % (error, text)
+    return text
+
+
+class FrameDecoder(object):
+    """
+    Base class of the streaming decoders. `feed` is called with each received
+    chunk and returns the frames it completed. Decoders keep all state
+    between calls, so bytes are never scanned twice and frames may span any
+    number of chunks.
+
+    Frames are returned as (payload, error) tuples where error is None, or
+    'decode error' or 'crc error' for frames that failed. Failures are also
+    counted in `decode_errors` and `crc_errors`.
+    """
+    def __init__(self, crc=None, max_length=65536):
+        """
+        Parameters
+        ----------
+        crc : sermon.crc.CRC or None
+            Checksum expected at the end of every frame.
+        max_length : int
+            Frames longer than this are discarded as decode errors.
+        """
+        self.crc = crc
+        self.max_length = max_length
+        self.frames = 0
+        self.decode_errors = 0
+        self.crc_errors = 0
+
+    def feed(self, data):
+        raise NotImplementedError()
+
+    def _frame(self, frame, error=None):
+        """
+        Checks and counts a complete frame.
+        """
+        if error is None and self.crc is not None:
+            frame, ok = self.crc.check(frame)
+            if not ok:
+                error = 'crc error'
+                self.crc_errors += 1
+        elif error is not None:
+            self.decode_errors += 1
+        if error is None:
+            self.frames += 1
+        return bytes(frame), error
+
+
+class DelimitedDecoder(FrameDecoder):
+    """
+    Decoder for protocols separating frames with a delimiter byte. Only new
+    data is searched for the delimiter, the stuffed bytes of the frame being
+    received are collected and unstuffed once when it ends.
+    """
+    delimiter = None
+
+    def __init__(self, *args, **kwargs):
+        super(DelimitedDecoder, self).__init__(*args, **kwargs)
+        self._raw = bytearray()
+        self._overflow = False
+
+    def feed(self, data):
+        frames = []
+        start = 0
+        while True:
+            end = data.find(self.delimiter, start)
+            if end < 0:
+                self._collect(data[start:])
+                return frames
+            self._collect(data[start:end])
+            if self._overflow:
+                frames.append(self._frame(b'', 'decode error'))
+            elif len(self._raw) > 0:
+                try:
+                    frames.append(self._frame(self.unstuff(bytes(self._raw))))
+                except ValueError:
+                    frames.append(self._frame(bytes(self._raw),
+                                              'decode error'))
+            self._raw = bytearray()
+            self._overflow = False
+            start = end + 1
+
+    def _collect(self, data):
+        if self._overflow:
+            return
+        self._raw += data
+        if len(self._raw) > self.max_length:
+            self._raw = bytearray()
+            self._overflow = True
+
+    def unstuff(self, raw):
+        """
+        Removes byte stuffing from a complete frame.
+
+        Raises
+        ------
+        ValueError
+            If the frame contains an invalid escape sequence.
+        """
+        raise NotImplementedError()
+
+
+class HDLCDecoder(DelimitedDecoder):
+    """
+    HDLC asynchronous framing: frames are delimited by 0x7E, and 0x7E and
+    0x7D inside a frame are sent as 0x7D followed by the byte xor 0x20.
+    """
+    delimiter = b'\x7e'
+
+    def unstuff(self, raw):
+        parts = raw.split(b'\x7d')
+        data = bytearray(parts[0])
+        for part in parts[1:]:
+            if len(part) == 0:
+                raise ValueError('Invalid escape.')
+            data.append(bytearray(part)[0] ^ 0x20)
+            data += part[1:]
+        return bytes(data)
+
+
+class SLIPDecoder(DelimitedDecoder):
+    """
+    SLIP (RFC 1055): frames end with 0xC0, 0xC0 and 0xDB inside a frame are
+    sent as 0xDB 0xDC and 0xDB 0xDD.
+    """
+    delimiter = b'\xc0'
+    escapes = {0xdc: 0xc0, 0xdd: 0xdb}
+
+    def unstuff(self, raw):
+        parts = raw.split(b'\xdb')
+        data = bytearray(parts[0])
+        for part in parts[1:]:
+            if len(part) == 0 or bytearray(part)[0] not in self.escapes:
+                raise ValueError('Invalid escape.')
+            data.append(self.escapes[bytearray(part)[0]])
+            data += part[1:]
+        return bytes(data)
+
+
+class COBSDecoder(DelimitedDecoder):
+    """
+    Consistent Overhead Byte Stuffing: frames are delimited by 0x00, which
+    never occurs inside an encoded frame.
+    """
+    delimiter = b'\x00'
+
+    def unstuff(self, raw):
+        raw = bytearray(raw)
+        data = bytearray()
+        pos = 0
+        while pos < len(raw):
+            code = raw[pos]
+            end = pos + code
+            if code == 0 or end > len(raw):
+                raise ValueError('Invalid COBS block.')
+            data += raw[pos + 1:end]
+            if code < 0xFF and end < len(raw):
+                data.append(0)
+            pos = end
+        return bytes(data)
+
+
+class LengthPrefixDecoder(FrameDecoder):
+    """
+    Frames starting with a fixed size header holding the payload length as
+    an unsigned integer. The length does not include the header or the
+    checksum.
+    """
+    def __init__(self, crc=None, max_length=65536, length_bytes=2,
+                 byteorder='big'):
+        """
+        Parameters
+        ----------
+        length_bytes : int
+            Size of the length header.
+        byteorder : str
+            'big' or 'little', the byte order of the length header.
+        """
+        super(LengthPrefixDecoder, self).__init__(crc, max_length)
+        self.length_bytes = length_bytes
+        self.byteorder = byteorder
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        frames = []
+        self._buffer += data
+        buf = self._buffer
+        pos = 0
+        crc_size = self.crc.size if self.crc is not None else 0
+        while len(buf) - pos >= self.length_bytes:
+            header = bytes(buf[pos:pos + self.length_bytes])
+            length = int.from_bytes(header, self.byteorder)
+            if length > self.max_length:
+                # Lost sync, skip a byte and look for a plausible header.
+                frames.append(self._frame(header, 'decode error'))
+                pos += 1
+                continue
+            end = pos + self.length_bytes + length + crc_size
+            if end > len(buf):
+                break
+            frames.append(self._frame(buf[pos + self.length_bytes:end]))
+            pos = end
+        del buf[:pos]
+        return frames
+
+
+decoders = {
+    'hdlc': HDLCDecoder,
+    'slip': SLIPDecoder,
+    'cobs': COBSDecoder,
+    'lenprefix': LengthPrefixDecoder,
+}
+
+
+def make_decoder(protocol, crc=None, length_bytes=2, byteorder='big'):
+    """
+    Creates a decoder for the protocol named on the command line.
+
+    Parameters
+    ----------
+    protocol : str
+        One of 'hdlc', 'slip', 'cobs' or 'lenprefix'.
+    crc : sermon.crc.CRC or None
+        Checksum expected at the end of every frame.
+    length_bytes : int
+        Header size for 'lenprefix'.
+    byteorder : str
+        Header byte order for 'lenprefix'.
+    """
+    if protocol == 'lenprefix':
+        return LengthPrefixDecoder(crc, length_bytes=length_bytes,
+                                   byteorder=byteorder)
+    return decoders[protocol](crc)
+
+
+class FrameEncoder(object):
+    """
+    Base class of the frame encoders. `encode` appends the checksum to a
+    payload and stuffs the result in a single call, using `bytes.replace`
+    and slicing so the per-byte work happens in C.
+    """
+    def __init__(self, crc=None):
+        """
+        Parameters
+        ----------
+        crc : sermon.crc.CRC or None
+            Checksum appended to every frame.
+        """
+        self.crc = crc
+
+    def encode(self, payload):
+        """
+        Returns the complete frame for `payload`.
+
+        Raises
+        ------
+        ValueError
+            If the payload can't be sent in a single frame.
+        """
+        if self.crc is not None:
+            payload = self.crc.append(payload)
+        return self.stuff(bytes(payload))
+
+    def stuff(self, data):
+        raise NotImplementedError()
+
+
+class HDLCEncoder(FrameEncoder):
+    def stuff(self, data):
+        return (b'\x7e' + data.replace(b'\x7d', b'\x7d\x5d')
+                .replace(b'\x7e', b'\x7d\x5e') + b'\x7e')
+
+
+class SLIPEncoder(FrameEncoder):
+    def stuff(self, data):
+        # A leading END flushes any line noise received by the device.
+        return (b'\xc0' + data.replace(b'\xdb', b'\xdb\xdd')
+                .replace(b'\xc0', b'\xdb\xdc') + b'\xc0')
+
+
+class COBSEncoder(FrameEncoder):
+    def stuff(self, data):
+        out = bytearray()
+        for block in data.split(b'\x00'):
+            pos = 0
+            while len(block) - pos >= 254:
+                out.append(0xFF)
+                out += block[pos:pos + 254]
+                pos += 254
+            out.append(len(block) - pos + 1)
+            out += block[pos:]
+        out.append(0)
+        return bytes(out)
+
+
+class LengthPrefixEncoder(FrameEncoder):
+    def __init__(self, crc=None, length_bytes=2, byteorder='big'):
+        super(LengthPrefixEncoder, self).__init__(crc)
+        self.length_bytes = length_bytes
+        self.byteorder = byteorder
+
+    def encode(self, payload):
+        payload = bytes(payload)
+        try:
+            header = len(payload).to_bytes(self.length_bytes, self.byteorder)
+        except OverflowError:
+            raise ValueError('Frame too long for a %d byte length header.' %
+                             self.length_bytes)
+        if self.crc is not None:
+            payload = self.crc.append(payload)
+        return header + payload
+
+
+encoders = {
+    'hdlc': HDLCEncoder,
+    'slip': SLIPEncoder,
+    'cobs': COBSEncoder,
+    'lenprefix': LengthPrefixEncoder,
+}
+
+
+def make_encoder(protocol, crc=None, length_bytes=2, byteorder='big'):
+    """
+    Creates an encoder for the protocol named on the command line, see
+    `make_decoder`.
+    """
+    if protocol == 'lenprefix':
+        return LengthPrefixEncoder(crc, length_bytes=length_bytes,
+                                   byteorder=byteorder)
+    return encoders[protocol](crc)
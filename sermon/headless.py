@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streams a serial device to stdout and stdin to the device without a UI.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import signal
+import threading
+import time
+
+import serial
+
+import sermon.util as util
+from sermon.supervisor import Reconnector
+from sermon.writer import SerialWriter
+from sermon.stats import Stats
+from sermon.hexdump import HexDumper
+from sermon.framing import make_decoder, make_encoder, format_frame
+from sermon.crc import crcs
+from sermon.timestamps import LineTimestamper
+
+
+def write_all(fd, data):
+    """
+    Writes all of data to a file descriptor without copying it.
+    """
+    view = memoryview(data)
+    while len(view) > 0:
+        view = view[os.write(fd, view):]
+
+
+class Headless(object):
+    """
+    Serial monitor for pipelines and daemons. Received bytes are written to
+    stdout unchanged, lines read from stdin are encoded like commands typed
+    at the prompt (including --frame, --append and ${...} byte lists) and sent
+    to the device through a `SerialWriter`. No urwid loop is created, the
+    main thread reads the device and a second thread reads stdin.
+    """
+    def __init__(self, device, args, stdin=None, stdout=None):
+        """
+        Parameters
+        ----------
+        device : str
+            Device name, path or URL.
+        args : argparse.Namespace
+            Parsed command line arguments.
+        stdin : int or None
+            File descriptor commands are read from, defaults to stdin.
+        stdout : int or None
+            File descriptor received data is written to, defaults to stdout.
+        """
+        self.stdin = stdin if stdin is not None else sys.stdin.fileno()
+        self.stdout = stdout if stdout is not None else sys.stdout.fileno()
+        self.framer = None
+        if args.tx_protocol is not None:
+            self.framer = make_encoder(args.tx_protocol,
+                                       crcs.get(args.tx_crc),
+                                       args.length_bytes, args.length_order)
+        self.encoder = util.CommandEncoder(util.unescape(args.frame),
+                                           util.unescape(args.append),
+                                           framer=self.framer)
+        self.read_chunk = args.read_chunk
+        self.device = device
+        self.serial = util.open_serial(device, args)
+        self.writer = SerialWriter(self.serial)
+        self.bridge = None
+        if args.serve is not None:
+            self.bridge = util.serve(
+                args.serve, lambda data: self.writer.write(data, block=False))
+        self.stop_event = threading.Event()
+        self.reconnector = Reconnector(device, args, self.stop_event)
+        self.stats = Stats()
+        self.hexdumper = HexDumper() if args.hex else None
+        self.hex_mode = args.hex
+        self.timestamper = None
+        if args.timestamps is not None and not args.hex:
+            self.timestamper = LineTimestamper(args.timestamps)
+        self.decoder = None
+        if args.rx_protocol is not None:
+            self.decoder = make_decoder(args.rx_protocol,
+                                        crcs.get(args.rx_crc),
+                                        args.length_bytes, args.length_order)
+        if args.stats_log is not None:
+            self.stats.start_dump(args.stats_log, args.stats_interval,
+                                  self.stop_event)
+
+        self.worker = threading.Thread(target=self.stdin_worker)
+        self.worker.daemon = True
+
+    def stdin_worker(self):
+        """
+        Sends each line read from stdin to the serial device.
+        """
+        # Read the descriptor directly rather than through sys.stdin, whose
+        # buffer lock would be held at interpreter shutdown.
+        pending = b''
+        for data in iter(lambda: os.read(self.stdin, 65536), b''):
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                self.send_line(line)
+        if len(pending) > 0:
+            self.send_line(pending)
+
+    def send_line(self, line):
+        """
+        Encodes a line read from stdin as a command and sends it.
+        """
+        command = line.rstrip(b'\r').decode('latin1')
+        try:
+            data = self.encoder.encode(command)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return
+        self.writer.write(data)
+
+    def format_hex(self, data):
+        """
+        Returns the hex dump rows completed by data, incomplete rows are
+        written once they fill up.
+        """
+        lines = self.hexdumper.feed(data)
+        if len(lines) == 0:
+            return b''
+        return ('\n'.join(lines) + '\n').encode('latin1')
+
+    def format_frames(self, data):
+        """
+        Returns a line for each frame completed by data.
+        """
+        lines = [format_frame(frame, error, self.hex_mode)
+                 for frame, error in self.decoder.feed(data)]
+        if len(lines) == 0:
+            return b''
+        return ('\n'.join(lines) + '\n').encode('latin1')
+
+    def run(self):
+        """
+        Streams data until interrupted or stdout is closed.
+        """
+        signal.signal(signal.SIGTERM, _terminate)
+        self.worker.start()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    data = util.read_available(self.serial, self.read_chunk)
+                except (serial.SerialException, OSError):
+                    print('%s lost, reconnecting.' % self.device,
+                          file=sys.stderr)
+                    ser = self.reconnector.reconnect(self.serial)
+                    if ser is not None:
+                        self.serial = ser
+                        self.writer.serial = ser
+                        print(self.reconnector.status_str(), file=sys.stderr)
+                    continue
+                if len(data) > 0:
+                    now = time.monotonic()
+                    waiting = len(data)
+                    if waiting == self.read_chunk:
+                        # More may be waiting, sample the OS buffer.
+                        waiting += self.serial.in_waiting
+                    self.stats.record_read(len(data), waiting)
+                    if self.bridge is not None:
+                        self.bridge.broadcast(data)
+                    if self.decoder is not None:
+                        data = self.format_frames(data)
+                    elif self.hexdumper is not None:
+                        data = self.format_hex(data)
+                    elif self.timestamper is not None:
+                        data = self.timestamper.stamp(data, now)
+                    write_all(self.stdout, data)
+        except (KeyboardInterrupt, SystemExit, BrokenPipeError):
+            pass
+        finally:
+            self.stop_event.set()
+            # Give commands already read from stdin a moment to be sent.
+            self.writer.wait(0, 1.0)
+            self.writer.close()
+            if self.bridge is not None:
+                self.bridge.close()
+            self.serial.close()
+            if self.hexdumper is not None and len(self.hexdumper.row) > 0:
+                try:
+                    write_all(self.stdout,
+                              (self.hexdumper.partial() + '\n').encode('latin1'))
+                except OSError:
+                    pass
+
+
+def _terminate(signum, frame):
+    raise SystemExit()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental hex dump formatting of received data.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+# Lookup tables so formatting a byte is an index instead of a format call.
+hex_table = ['%02x ' % n for n in range(256)]
+ascii_table = bytes(bytearray(n if 32 <= n < 127 else ord('.')
+                              for n in range(256)))
+
+
+class HexDumper(object):
+    """
+    Formats a byte stream as offset/hex/ASCII rows like `hexdump -C`. Data is
+    fed in chunks as it arrives and only the new bytes, plus the incomplete
+    row they extend, are formatted, so the cost per chunk does not depend on
+    how much has been dumped before.
+    """
+    def __init__(self, width=16):
+        """
+        Parameters
+        ----------
+        width : int
+            Number of bytes per row.
+        """
+        self.width = width
+        self.offset = 0
+        self.row = b''
+
+    def format_row(self, offset, row):
+        """
+        Formats up to `width` bytes starting at stream offset `offset`.
+        """
+        half = self.width // 2
+        hex_str = ''.join([hex_table[b] for b in bytearray(row[:half])])
+        if len(row) > half:
+            hex_str += ' ' + ''.join([hex_table[b]
+                                      for b in bytearray(row[half:])])
+        return '%08x  %-*s |%s|' % (offset, 3 * self.width + 1, hex_str,
+                                    row.translate(ascii_table).decode('latin1'))
+
+    def feed(self, data):
+        """
+        Adds received bytes.
+
+        Returns
+        -------
+        lines : list of str
+            The rows completed by `data`.
+        """
+        lines = []
+        if len(self.row) > 0:
+            need = self.width - len(self.row)
+            self.row += data[:need]
+            data = data[need:]
+            if len(self.row) < self.width:
+                return lines
+            lines.append(self.format_row(self.offset, self.row))
+            self.offset += self.width
+        end = len(data) - len(data) % self.width
+        for pos in range(0, end, self.width):
+            lines.append(self.format_row(self.offset,
+                                         data[pos:pos + self.width]))
+            self.offset += self.width
+        self.row = bytes(data[end:])
+        return lines
+
+    def partial(self):
+        """
+        Returns the incomplete row currently being received, or '' if there
+        is none.
+        """
+        if len(self.row) == 0:
+            return ''
+        return self.format_row(self.offset, self.row)
+
+    def reset(self):
+        """
+        Discards the incomplete row and restarts offsets at zero.
+        """
+        self.offset = 0
+        self.row = b''
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+Background writer for logfiles.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import queue
+import threading
+import time
+
+
+class LogWriter(object):
+    """
+    Writes received data to a logfile from a dedicated thread. Chunks are
+    handed over through a bounded queue and written to a single binary file
+    handle, so the data is logged byte for byte without any per-chunk open or
+    close. The file is flushed when its buffer fills or every
+    `flush_interval` seconds, and optionally rotated by size or age.
+
+    Errors are kept in `error`. Once the file is unusable, e.g. because it
+    couldn't be reopened after rotating, the thread keeps taking chunks off
+    the queue and discards them, so callers never block on a full queue.
+    """
+    _flush_item = object()
+    _close_item = object()
+
+    def __init__(self, filename, rotate_bytes=None, rotate_seconds=None,
+                 buffer_size=65536, flush_interval=1.0, queue_size=1024):
+        """
+        Parameters
+        ----------
+        filename : str
+            Path of the logfile, truncated if it exists.
+        rotate_bytes : int or None
+            Rotate once the file reaches this size.
+        rotate_seconds : float or None
+            Rotate once the file has been open this long.
+        buffer_size : int
+            Size of the file buffer, data is written once it fills.
+        flush_interval : float
+            Maximum number of seconds data stays buffered.
+        queue_size : int
+            Maximum number of chunks waiting to be written.
+        """
+        self.filename = filename
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.error = None
+        self.rotations = 0
+        self.bytes_written = 0
+        self._queue = queue.Queue(queue_size)
+        self._open()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        """
+        Queues data to be written. Blocks if the queue is full, data is
+        dropped once the thread has stopped.
+        """
+        if self._stopped():
+            return
+        self._queue.put(data)
+
+    def flush(self):
+        """
+        Blocks until everything queued so far has been written to disk, or
+        has failed to be.
+        """
+        if self._stopped():
+            return
+        done = threading.Event()
+        self._queue.put((self._flush_item, done))
+        done.wait()
+
+    def close(self):
+        """
+        Writes everything queued, closes the file and stops the thread.
+        """
+        if not self._thread.is_alive():
+            return
+        self._queue.put((self._close_item, None))
+        self._thread.join()
+
+    @property
+    def pending(self):
+        """
+        Number of chunks waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def _stopped(self):
+        """
+        True if the thread is no longer running, setting `error` if it
+        ended without being closed.
+        """
+        if self._thread.is_alive():
+            return False
+        if self.error is None:
+            self.error = IOError('Log writer is closed.')
+        return True
+
+    def _open(self):
+        self._file = open(self.filename, 'wb', self.buffer_size)
+        self._opened = time.monotonic()
+        self._written = 0
+
+    def _write(self, data):
+        self._file.write(data)
+
+    def _flush(self, complete=False):
+        """
+        Flushes the file, `complete` is set when a flush or close was
+        requested rather than the flush interval passing.
+        """
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+    def _rename(self, target):
+        os.rename(self.filename, target)
+
+    def _rotate(self):
+        self._close()
+        self.rotations += 1
+        while os.path.exists('%s.%d' % (self.filename, self.rotations)):
+            self.rotations += 1
+        self._rename('%s.%d' % (self.filename, self.rotations))
+        self._open()
+
+    def _due_for_rotation(self):
+        if self._written == 0:
+            return False
+        if self.rotate_bytes is not None and \
+                self._written >= self.rotate_bytes:
+            return True
+        return (self.rotate_seconds is not None and
+                time.monotonic() - self._opened >= self.rotate_seconds)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        failed = False
+        while True:
+            timeout = max(0, last_flush + self.flush_interval -
+                          time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if failed:
+                # Keep draining so writers never block, nothing is written.
+                if isinstance(item, tuple):
+                    if item[0] is self._close_item:
+                        self._abandon()
+                        return
+                    item[1].set()
+                last_flush = time.monotonic()
+                continue
+            try:
+                if isinstance(item, tuple):
+                    self._flush(complete=True)
+                    last_flush = time.monotonic()
+                    if item[0] is self._close_item:
+                        self._close()
+                        return
+                    item[1].set()
+                    continue
+                if item is not None:
+                    self._write(item)
+                    self._written += len(item)
+                    self.bytes_written += len(item)
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    self._flush()
+                    last_flush = time.monotonic()
+                if self._due_for_rotation():
+                    self._rotate()
+            except Exception as e:
+                self.error = e
+                # Errors writing an open file, e.g. a full disk, may pass,
+                # anything else leaves the file unusable.
+                failed = (not isinstance(e, (IOError, OSError)) or
+                          self._file.closed)
+                if isinstance(item, tuple):
+                    if item[0] is self._close_item:
+                        self._abandon()
+                        return
+                    item[1].set()
+
+    def _abandon(self):
+        """
+        Closes whatever is still open after an error.
+        """
+        try:
+            self._close()
+        except Exception:
+            pass
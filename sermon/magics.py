@@ -13,7 +13,14 @@ import os
 import shlex
 
 import sermon
+import sermon.util as util
 from sermon.util import ThrowingArgumentParser
+from sermon.logger import LogWriter
+from sermon.blocklog import BlockLogWriter
+from sermon.capture import CaptureWriter
+from sermon.transfer import FileTransfer
+from sermon.expect import ExpectScript, parse_step, read_script
+from sermon.triggers import Trigger, parse_action
 from sermon.resources import help_str, about_str
 
 
@@ -77,13 +84,34 @@ def logstart(app, cmd_args):
     """
     parser = ThrowingArgumentParser()
     parser.add_argument('filename', type=str)
+    parser.add_argument('--rotate', type=str, default=None)
+    parser.add_argument('--compress', type=str, default=None,
+                        choices=('gzip', 'lzma'))
     args = parser.parse_args(cmd_args)
     filename = os.path.expanduser(args.filename)
 
+    rotate_bytes = None
+    rotate_seconds = None
+    if args.rotate is not None:
+        try:
+            rotate_bytes = util.parse_size(args.rotate)
+        except ValueError:
+            rotate_seconds = util.parse_duration(args.rotate)
+        if not (rotate_bytes or rotate_seconds):
+            raise ValueError('Rotation size or interval must be positive.')
+
+    app.stop_logging()
     try:
-        f = open(filename, 'w')
-        f.close()
-    except:
+        if args.compress is not None:
+            app.logger = BlockLogWriter(filename,
+                                        compress=args.compress,
+                                        rotate_bytes=rotate_bytes,
+                                        rotate_seconds=rotate_seconds)
+        else:
+            app.logger = LogWriter(filename,
+                                   rotate_bytes=rotate_bytes,
+                                   rotate_seconds=rotate_seconds)
+    except (IOError, OSError):
         raise ValueError('Invalid filename specified.')
 
     app.logfile = filename
@@ -98,7 +126,7 @@ def logon(app, args):
     """
     Resumes logging. Logging must have already been started with %logstart.
     """
-    if app.logfile is None:
+    if app.logger is None:
         raise ValueError("Logging must first be started with %logstart.")
     app.logging = True
     return {'status': 'Logging resumed.',
@@ -111,10 +139,67 @@ def logoff(app, args):
     Turns off logging.
     """
     app.logging = False
+    if app.logger is not None:
+        app.logger.flush()
     return {'status': 'Logging stopped.',
             'bytes_to_send': None}
 
 
+@magic.cmd(['capture', 'cap'])
+def capture(app, cmd_args):
+    """
+    Starts recording received and sent data with timestamps to a capture
+    file, which can be replayed with --replay.
+    """
+    parser = ThrowingArgumentParser()
+    parser.add_argument('filename', type=str)
+    args = parser.parse_args(cmd_args)
+    filename = os.path.expanduser(args.filename)
+
+    try:
+        writer = CaptureWriter(filename)
+    except (IOError, OSError):
+        raise ValueError('Invalid filename specified.')
+    app.start_capture(writer)
+
+    return {'status': 'Capturing to %s.' % filename,
+            'bytes_to_send': None}
+
+
+@magic.cmd(['capturestop', 'cs'])
+def capturestop(app, args):
+    """
+    Stops capturing and closes the capture file.
+    """
+    if app.capture is None:
+        raise ValueError('No capture in progress.')
+    filename = app.capture.filename
+    app.stop_capture()
+    return {'status': 'Capture to %s stopped.' % filename,
+            'bytes_to_send': None}
+
+
+@magic.cmd(['export', 'ex'])
+def export(app, cmd_args):
+    """
+    Writes the buffered telemetry to a CSV or binary file.
+    """
+    parser = ThrowingArgumentParser()
+    parser.add_argument('filename', type=str)
+    parser.add_argument('--binary', action='store_true')
+    args = parser.parse_args(cmd_args)
+    filename = os.path.expanduser(args.filename)
+
+    if app.telemetry is None:
+        raise ValueError('Telemetry is off, start with --telemetry.')
+    try:
+        rows = app.telemetry.export(filename, binary=args.binary)
+    except (IOError, OSError):
+        raise ValueError('Invalid filename specified.')
+    return {'status': 'Exported %d rows to %s.' % (rows, filename),
+            'bytes_to_send': None}
+
+
 @magic.cmd(['version', 'v'])
 def version(app, args):
     """
@@ -127,21 +212,229 @@ def version(app, args):
 @magic.cmd(['send', 's'])
 def send(app, cmd_args):
     """
-    Sends the contents of the given file to the serial device.
+    Streams the contents of the given file to the serial device in chunks.
     """
     parser = ThrowingArgumentParser()
     parser.add_argument('filename', type=str)
+    parser.add_argument('--chunk', type=str, default='4096')
+    parser.add_argument('--delay', type=str, default='0')
+    parser.add_argument('--drain', action='store_true')
     args = parser.parse_args(cmd_args)
     filename = os.path.expanduser(args.filename)
 
+    if app.transfer is not None:
+        raise ValueError('Already sending %s, use %%cancel to stop.' %
+                         app.transfer.filename)
+    chunk_size = util.parse_size(args.chunk)
+    if chunk_size < 1:
+        raise ValueError('Chunk size must be positive.')
+    delay = util.parse_duration(args.delay)
+
     try:
-        with open(filename, 'rb') as f:
-            data = f.read()
-    except:
+        transfer = FileTransfer(filename, app.writer,
+                                chunk_size=chunk_size,
+                                delay=delay,
+                                drain=args.drain,
+                                framer=app.framer)
+    except (IOError, OSError):
         raise ValueError('Unable to read file.')
+    app.start_transfer(transfer)
+
+    return {'status': 'Sending %s' % filename,
+            'bytes_to_send': None}
+
+
+@magic.cmd(['cancel', 'x'])
+def cancel(app, args):
+    """
+    Cancels the file currently being sent, or else the running script.
+    """
+    if app.transfer is not None:
+        task = app.transfer
+        app.transfer = None
+    elif app.script is not None:
+        task = app.script
+        app.script = None
+    else:
+        raise ValueError('No file is being sent and no script is running.')
+    task.cancel()
+    return {'status': task.status_str(),
+            'bytes_to_send': None}
+
+
+def start_script(app, steps, name):
+    if app.script is not None:
+        raise ValueError('Already running %s, use %%cancel to stop.' %
+                         app.script.name)
+    app.start_script(ExpectScript(steps, app.expecter, app.writer, name))
+    return {'status': None,
+            'bytes_to_send': None}
+
+
+@magic.cmd(['expect', 'e'])
+def expect(app, cmd_args):
+    """
+    Waits in the background for a received line matching a regular
+    expression.
+    """
+    step = parse_step('expect', cmd_args, app.encoder)
+    return start_script(app, [step], 'expect')
+
+
+@magic.cmd(['sendexpect', 'se'])
+def sendexpect(app, cmd_args):
+    """
+    Sends a command and waits in the background for a received line matching
+    a regular expression, timing the round trip.
+    """
+    step = parse_step('sendexpect', cmd_args, app.encoder)
+    return start_script(app, [step], 'sendexpect')
+
+
+@magic.cmd(['script', 'sc'])
+def script(app, cmd_args):
+    """
+    Runs a file of commands to send and replies to expect.
+    """
+    parser = ThrowingArgumentParser()
+    parser.add_argument('filename', type=str)
+    args = parser.parse_args(cmd_args)
+    filename = os.path.expanduser(args.filename)
+
+    steps = read_script(filename, app.encoder)
+    return start_script(app, steps, os.path.basename(filename))
+
+
+@magic.cmd(['stats', 'st'])
+def stats(app, args):
+    """
+    Displays an overlay with throughput and latency statistics.
+    """
+    app.overlay(app.stats.report_str())
+    return {'status': None,
+            'bytes_to_send': None}
+
+
+@magic.cmd('hex')
+def hex(app, args):
+    """
+    Toggles displaying received data as a hex dump.
+    """
+    app.set_hex_mode(not app.hex_mode)
+    return {'status': 'Hex display %s.' % ('on' if app.hex_mode else 'off'),
+            'bytes_to_send': None}
+
+
+@magic.cmd(['find', 'f'])
+def find(app, cmd_args):
+    """
+    Jumps to the closest line above the focus matching a regular expression.
+    """
+    parser = ThrowingArgumentParser()
+    parser.add_argument('pattern', type=str, nargs='?', default=None)
+    parser.add_argument('--clear', action='store_true')
+    args = parser.parse_args(cmd_args)
+
+    if args.clear:
+        app.stop_find()
+        return {'status': 'Search cleared.',
+                'bytes_to_send': None}
+    app.find(args.pattern)
+    return {'status': None,
+            'bytes_to_send': None}
+
 
-    return {'status': 'Sent %s' % filename,
-            'bytes_to_send': data}
+@magic.cmd(['filter', 'fl'])
+def filter(app, cmd_args):
+    """
+    Shows only lines matching a regular expression, or all lines if no
+    pattern is given.
+    """
+    parser = ThrowingArgumentParser()
+    parser.add_argument('pattern', type=str, nargs='?', default=None)
+    args = parser.parse_args(cmd_args)
+
+    app.set_filter(args.pattern)
+    if args.pattern is None:
+        return {'status': 'Filter removed.',
+                'bytes_to_send': None}
+    return {'status': 'Showing lines matching %s' % args.pattern,
+            'bytes_to_send': None}
+
+
+@magic.cmd(['trigger', 'tr'])
+def trigger(app, cmd_args):
+    """
+    Adds, lists or removes patterns watched for in all received data.
+    """
+    parser = ThrowingArgumentParser()
+    parser.add_argument('command', type=str,
+                        choices=('add', 'list', 'del', 'clear'))
+    parser.add_argument('pattern', type=str, nargs='?', default=None)
+    parser.add_argument('--action', type=str, default='beep')
+    args = parser.parse_args(cmd_args)
+    triggers = app.triggers
+
+    if args.command == 'list':
+        app.overlay(triggers.report_str())
+        return {'status': None,
+                'bytes_to_send': None}
+    if args.command == 'clear':
+        triggers.clear()
+        return {'status': 'Triggers removed.',
+                'bytes_to_send': None}
+    if args.pattern is None:
+        raise ValueError('%%trigger %s needs a %s.' % (
+            args.command, 'pattern' if args.command == 'add' else 'number'))
+    if args.command == 'del':
+        try:
+            n = int(args.pattern)
+        except ValueError:
+            raise ValueError('Invalid trigger number %s.' % args.pattern)
+        if not 1 <= n <= len(triggers):
+            raise ValueError('No trigger %d.' % n)
+        triggers.remove(n - 1)
+        return {'status': 'Trigger %d removed.' % n,
+                'bytes_to_send': None}
+
+    action, data = parse_action(args.action, app.encoder)
+    triggers.add(Trigger(args.pattern, action, data))
+    return {'status': 'Trigger %d added.' % len(triggers),
+            'bytes_to_send': None}
+
+
+@magic.cmd(['tab', 't'])
+def tab(app, cmd_args):
+    """
+    Shows the device with the given number, when monitoring several.
+    """
+    parser = ThrowingArgumentParser()
+    parser.add_argument('number', type=int)
+    args = parser.parse_args(cmd_args)
+
+    if app.group is None:
+        raise ValueError('Only one device is open.')
+    if not 1 <= args.number <= len(app.group.sessions):
+        raise ValueError('No device %d.' % args.number)
+    app.group.select(args.number - 1)
+    return {'status': None,
+            'bytes_to_send': None}
+
+
+@magic.cmd(['broadcast', 'b'])
+def broadcast(app, args):
+    """
+    Toggles sending input at the prompt to all devices.
+    """
+    if app.group is None:
+        raise ValueError('Only one device is open.')
+    app.group.set_broadcast(not app.group.broadcast)
+    if app.group.broadcast:
+        status = 'Sending to all devices.'
+    else:
+        status = 'Sending to the device shown.'
+    return {'status': status,
+            'bytes_to_send': None}
 
 
 @magic.cmd(['clear', 'c'])
@@ -149,7 +442,7 @@ def clear(app, args):
     """
     Clears the received data window.
     """
-    app.receive_window.set_text('')
+    app.clear()
     return {'status': None,
             'bytes_to_send': None}
 
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+A single reader thread for many serial devices.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import selectors
+import socket
+import threading
+
+import serial
+
+import sermon.util as util
+
+
+class DeviceReader(object):
+    """
+    Reads any number of devices from one thread blocked in a single
+    selector over all their file descriptors, so idle devices cost nothing
+    and CPU use follows the amount of data received rather than the number
+    of devices. Each device is a `Sermon` instance, received chunks are
+    passed to its `received_chunk`.
+
+    A lost device is removed from the selector and reopened by its
+    `Reconnector` on a separate thread, so the other devices keep being
+    read. Ports without a file descriptor, e.g. loop:// or --replay, are
+    read by their own `serial_read_worker` thread instead.
+    """
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._added = []
+        self._stop = False
+        self._threads = []
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, app):
+        """
+        Starts reading a device. Safe to call from any thread.
+        """
+        if util.fileno(app.serial) is None:
+            app.worker.start()
+            return
+        with self._lock:
+            self._added.append(app)
+        self._wake_w.send(b'.')
+
+    def stop(self):
+        """
+        Stops reading and waits for reconnect attempts to give up. The stop
+        events of all devices must be set first.
+        """
+        self._stop = True
+        self._wake_w.send(b'.')
+        if self._thread.ident is not None:
+            self._thread.join()
+        for thread in self._threads:
+            thread.join()
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _register(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except OSError:
+            pass
+        with self._lock:
+            added = self._added
+            self._added = []
+        for app in added:
+            self._selector.register(util.fileno(app.serial),
+                                    selectors.EVENT_READ, app)
+
+    def _lost(self, app, fd):
+        self._selector.unregister(fd)
+        if app.stop_event.is_set():
+            return
+        thread = threading.Thread(target=self._reconnect, args=(app,))
+        thread.daemon = True
+        self._threads = [t for t in self._threads if t.is_alive()]
+        self._threads.append(thread)
+        thread.start()
+
+    def _reconnect(self, app):
+        ser = app.reconnector.reconnect(app.serial)
+        if ser is not None:
+            app.serial = ser
+            app.writer.serial = ser
+            self.add(app)
+
+    def _run(self):
+        while not self._stop:
+            for key, events in self._selector.select():
+                if key.fileobj is self._wake_r:
+                    self._register()
+                    continue
+                app = key.data
+                try:
+                    data = util.read_available(app.serial, app.read_chunk)
+                except (serial.SerialException, OSError):
+                    self._lost(app, key.fileobj)
+                    continue
+                if len(data) > 0:
+                    app.received_chunk(data)
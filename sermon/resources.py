@@ -23,16 +23,58 @@ Display information about Sermon.
 Exit sermon.
 
 %send [FILE], %s [FILE]
-Send the contents of the given file to the connected serial device.
+Send the contents of the given file to the connected serial device. The file is streamed in chunks of --chunk SIZE bytes (default 4096), optionally waiting --delay TIME (e.g. 5ms) after each chunk, or with --drain until the device has taken each chunk. Progress is shown in the status bar. With --tx-protocol each chunk is sent as one frame.
+
+%cancel, %x
+Cancel the file currently being sent, or else the running expect or script. Commands typed at the prompt in the meantime are still sent.
+
+%sendexpect [CMD] [PATTERN], %se [CMD] [PATTERN]
+Send a command and wait in the background until a received line matches the regular expression PATTERN, for at most --timeout TIME (default 5s). The round trip time is shown in the status bar.
+
+%expect [PATTERN], %e [PATTERN]
+Wait for a received line matching PATTERN without sending anything. If a command was sent since the last pattern was armed or matched, the round trip from that command is recorded, otherwise only the time waited is shown.
+
+%script [FILE], %sc [FILE]
+Run a script: every line is sent like text typed at the prompt, except # comments and %expect, %sendexpect and %sleep TIME lines. Stops at the first timeout, the round trip times of the run are summarized in the status bar.
 
 %logstart [FILE], %ls [FILE]
-Start logging all received data to the given file.
+Start logging all received data to the given file. Use --rotate SIZE (e.g. 100M) or --rotate INTERVAL (e.g. 30min, 1h) to start a new file periodically, previous files are renamed FILE.1, FILE.2, ... Use --compress gzip or --compress lzma to compress the log in blocks, read them back with sermon --cat FILE --from TIME --to TIME.
 
 %logon, %lo
 Resume logging after a %logoff. %logstart must be called prior to using %logoff or %logon.
 
 %logoff, %lf
-Temporarily stop logging. Logging can be resumed using %logon.
+Temporarily stop logging and flush the logfile. Logging can be resumed using %logon.
+
+%capture [FILE], %cap [FILE]
+Record all received and sent data with timestamps to a capture file, which can be played back with sermon --replay FILE.
+
+%capturestop, %cs
+Stop capturing and close the capture file.
+
+%export [FILE], %ex [FILE]
+Write the rows buffered by --telemetry to a CSV file, or with --binary to a file of float64 columns.
+
+%stats, %st
+Display throughput and latency statistics.
+
+%hex
+Toggle displaying received data as an offset/hex/ASCII dump.
+
+%find [REGEX], %f [REGEX]
+Jump to the closest line above the current one matching the regular expression and highlight all matches. Without a pattern jump to the next match further up, %find --clear removes the highlighting.
+
+%filter [REGEX], %fl [REGEX]
+Show only lines matching the regular expression, matching lines keep being added as data arrives. Without a pattern show all lines again.
+
+%trigger add [PATTERN], %tr add [PATTERN]
+Watch all received data for PATTERN and run --action on every occurrence: beep (default), log[:FILE] to write the time and match to FILE (default triggers.log), or send:TEXT to send TEXT like a command. %trigger list shows the hit counts and first and last times, %trigger del N removes trigger N, %trigger clear removes all.
+
+%tab [N], %t [N]
+When monitoring several devices, show device N. Tab and shift-tab show the next and previous device.
+
+%broadcast, %b
+When monitoring several devices, toggle sending input at the prompt to all devices instead of the one shown.
 
 %clear, %c
 Clear the received data window.
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bounded storage for received data.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import threading
+
+
+class Scrollback(object):
+    """
+    A ring buffer of received lines with a limit on both the number of lines
+    and the total number of characters retained. Appending is O(1) amortized,
+    once either limit is reached the oldest lines are dropped.
+
+    Lines are addressed by an absolute index which keeps increasing for the
+    whole session, so positions remain valid as old lines are dropped. The
+    incomplete line currently being received is kept separately in `partial`
+    and has index `end`. A partial line reaching `max_line` characters is
+    broken into complete lines, so data without any newlines doesn't copy an
+    ever growing partial line with every chunk.
+
+    Changes are made by a single thread. Other threads may only read
+    through `batch`, which takes the lock held while lines are added.
+    """
+    def __init__(self, max_lines=10000, max_bytes=10485760, max_line=4096):
+        """
+        Parameters
+        ----------
+        max_lines : int
+            Maximum number of complete lines to retain.
+        max_bytes : int
+            Maximum number of characters to retain, including the partial
+            line.
+        max_line : int
+            Maximum length of the partial line appended text is kept in.
+        """
+        if max_lines < 1 or max_bytes < 1 or max_line < 1:
+            raise ValueError('Scrollback limits must be positive.')
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.max_line = max_line
+        self._ring = [None] * max_lines
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Removes all stored data. Absolute line indices keep counting from
+        where they were so existing positions are never reused.
+        """
+        with self._lock:
+            for n in range(len(self._ring)):
+                self._ring[n] = None
+            self._head = 0
+            self._count = 0
+            self.start = getattr(self, 'end', 0)
+            self.end = self.start
+            self.partial = ''
+            self.nbytes = 0
+
+    def __len__(self):
+        """
+        Number of complete lines currently retained.
+        """
+        return self._count
+
+    def append(self, text):
+        """
+        Appends received text, splitting it into lines on '\\n'.
+
+        Parameters
+        ----------
+        text : str
+            Decoded text to append.
+
+        Returns
+        -------
+        new_lines : int
+            The number of lines completed by this call, including those
+            broken at `max_line`.
+        """
+        if not text:
+            return 0
+        pieces = text.split('\n')
+        with self._lock:
+            self.nbytes += len(text) - (len(pieces) - 1)
+            pieces[0] = self.partial + pieces[0]
+            partial = pieces.pop()
+            for line in pieces:
+                self._push(line)
+            new_lines = len(pieces)
+            if len(partial) > self.max_line:
+                cut = len(partial) - len(partial) % self.max_line
+                for n in range(0, cut, self.max_line):
+                    self._push(partial[n:n + self.max_line])
+                new_lines += cut // self.max_line
+                partial = partial[cut:]
+            self.partial = partial
+            self._trim()
+        return new_lines
+
+    def append_lines(self, lines, partial=''):
+        """
+        Appends already split lines and replaces the partial line, for
+        content that is formatted line by line rather than appended as text.
+
+        Parameters
+        ----------
+        lines : list of str
+            Complete lines to append after the current complete lines.
+        partial : str
+            The new partial line.
+        """
+        with self._lock:
+            self.nbytes -= len(self.partial)
+            for line in lines:
+                self._push(line)
+                self.nbytes += len(line)
+            self.partial = partial
+            self.nbytes += len(partial)
+            self._trim()
+
+    def break_line(self):
+        """
+        Turns a non-empty partial line into a complete line.
+        """
+        if len(self.partial) > 0:
+            with self._lock:
+                self._push(self.partial)
+                self.partial = ''
+
+    def line(self, index):
+        """
+        Returns the line with absolute index `index`. The partial line is
+        returned for `index == end`.
+        """
+        if index == self.end:
+            return self.partial
+        if index < self.start or index > self.end:
+            raise IndexError('Line %d is not in scrollback.' % index)
+        n = len(self._ring)
+        return self._ring[(self._head + index - self.start) % n]
+
+    def lines(self, first=None, last=None):
+        """
+        Iterates over the complete lines between absolute indices `first`
+        and `last` (exclusive), clamped to what is retained.
+        """
+        first = self.start if first is None else max(first, self.start)
+        last = self.end if last is None else min(last, self.end)
+        n = len(self._ring)
+        for index in range(first, last):
+            yield self._ring[(self._head + index - self.start) % n]
+
+    def batch(self, first, count):
+        """
+        Returns up to `count` complete lines starting at absolute index
+        `first`, or the oldest retained line if that was dropped. Safe to
+        call from other threads.
+
+        Returns
+        -------
+        first : int
+            Absolute index of the first returned line.
+        lines : list of str
+            The lines.
+        """
+        with self._lock:
+            first = max(first, self.start)
+            last = min(first + count, self.end)
+            n = len(self._ring)
+            offset = self._head - self.start
+            return first, [self._ring[(offset + index) % n]
+                           for index in range(first, last)]
+
+    def text(self):
+        """
+        Returns the retained data as a single string.
+        """
+        return '\n'.join(list(self.lines()) + [self.partial])
+
+    def _push(self, line):
+        n = len(self._ring)
+        if self._count == n:
+            self._drop()
+        self._ring[(self._head + self._count) % n] = line
+        self._count += 1
+        self.end += 1
+
+    def _drop(self):
+        n = len(self._ring)
+        self.nbytes -= len(self._ring[self._head])
+        self._ring[self._head] = None
+        self._head = (self._head + 1) % n
+        self._count -= 1
+        self.start += 1
+
+    def _trim(self):
+        while self.nbytes > self.max_bytes and self._count > 0:
+            self._drop()
+        if self.nbytes > self.max_bytes:
+            # A single partial line larger than the limit, keep its tail.
+            self.partial = self.partial[-self.max_bytes:]
+            self.nbytes = len(self.partial)
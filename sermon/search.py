@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental regular expression index over the scrollback.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import bisect
+import re
+import threading
+
+
+class LineIndex(object):
+    """
+    The absolute indices of the scrollback lines matching a regular
+    expression. Lines are scanned in batches by a background thread, so
+    indexing a large scrollback never blocks the UI. Every line is scanned
+    once: `update` is called after lines are added and the thread continues
+    from where it stopped. `notify` is called from the thread whenever new
+    matches were found, or when the scan caught up with the scrollback
+    while `waiting` is set.
+    """
+    def __init__(self, scrollback, pattern, notify=None, batch_size=4096):
+        """
+        Parameters
+        ----------
+        scrollback : Scrollback
+            The lines to index.
+        pattern : str
+            The regular expression, matched anywhere in a line.
+        notify : callable or None
+            Called without arguments when results change.
+        batch_size : int
+            Number of lines copied from the scrollback and scanned at once.
+
+        Raises
+        ------
+        ValueError
+            If the pattern is not a valid regular expression.
+        """
+        try:
+            self.regex = re.compile(pattern)
+        except re.error as e:
+            raise ValueError('Invalid pattern: %s' % e)
+        self.pattern = pattern
+        self.scrollback = scrollback
+        self.notify = notify
+        self.batch_size = batch_size
+        self.scanned = scrollback.start
+        self.waiting = False
+        self._matches = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._wake.set()
+
+    def update(self):
+        """
+        Schedules scanning the lines added since the last call.
+        """
+        self._wake.set()
+
+    def close(self):
+        """
+        Stops the scanning thread.
+        """
+        self._stop = True
+        self._wake.set()
+        self._thread.join()
+
+    def __len__(self):
+        """
+        Number of matching lines still in the scrollback.
+        """
+        with self._lock:
+            return len(self._matches) - self._first()
+
+    def __contains__(self, position):
+        with self._lock:
+            n = bisect.bisect_left(self._matches, position)
+            return n < len(self._matches) and self._matches[n] == position
+
+    def before(self, position):
+        """
+        Returns the last match before `position`, or None.
+        """
+        with self._lock:
+            n = bisect.bisect_left(self._matches, position) - 1
+            if n < self._first():
+                return None
+            return self._matches[n]
+
+    def after(self, position):
+        """
+        Returns the first match after `position`, or None.
+        """
+        with self._lock:
+            n = max(bisect.bisect_right(self._matches, position),
+                    self._first())
+            if n >= len(self._matches):
+                return None
+            return self._matches[n]
+
+    def last(self):
+        """
+        Returns the newest match, or None.
+        """
+        with self._lock:
+            if len(self._matches) == self._first():
+                return None
+            return self._matches[-1]
+
+    def _first(self):
+        # Matches of lines already dropped from the scrollback are skipped,
+        # and removed by the scanning thread.
+        return bisect.bisect_left(self._matches, self.scrollback.start)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            found = False
+            while not self._stop:
+                first, lines = self.scrollback.batch(self.scanned,
+                                                     self.batch_size)
+                if len(lines) == 0:
+                    break
+                search = self.regex.search
+                matches = [first + n for n, line in enumerate(lines)
+                           if search(line)]
+                with self._lock:
+                    del self._matches[:self._first()]
+                    self._matches.extend(matches)
+                    self.scanned = first + len(lines)
+                if len(matches) > 0:
+                    found = True
+                    if self.notify is not None:
+                        self.notify()
+            if self._stop:
+                return
+            if not found and self.waiting and self.notify is not None:
+                # Let a waiting search know everything has been scanned.
+                self.notify()
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
 """
-The main application run loop.
+The command line entry point. The interactive interface, headless mode and
+log reader are imported only when used, so listing devices or printing the
+version doesn't pay for loading urwid.
 """
 
 from __future__ import print_function
@@ -15,23 +17,13 @@ if os.name == 'nt':
     print('sermon is not compatabile with Windows.')
     sys.exit()
 
-import threading
-import re
-import time
 import argparse
 
 import serial
-import urwid
 
 import sermon
 import sermon.util as util
-from sermon.magics import magic
-from sermon.resources import help_status_str
-
-try:
-    input = raw_input
-except NameError:
-    pass
+from sermon.crc import crcs
 
 
 parity_values = {'none': serial.PARITY_NONE,
@@ -45,251 +37,29 @@ stopbits_values = {'1': serial.STOPBITS_ONE,
                    '2': serial.STOPBITS_TWO}
 
 
-class ConsoleEdit(urwid.Edit):
-    def __init__(self, callback, *args, **kwargs):
-        super(ConsoleEdit, self).__init__(*args, **kwargs)
-        self.callback = callback
-        self.history = []
-        self.history_pos = 0
-
-    def keypress(self, size, key):
-        if key == 'enter':
-            self.callback(self.edit_text)
-            self.history.append(self.edit_text)
-            self.history_pos = 0
-            self.set_edit_text('')
-            return False
-        elif key == 'up':
-            # Cycle backwards in history, unless already as far back as we can
-            # go.
-            if self.history_pos == len(self.history):
-                # Already as far as we can go in history.
-                util.beep()
-                return
-            self.history_pos = util.limit(self.history_pos + 1,
-                                          1, len(self.history))
-            self.set_edit_text(
-                self.history[-self.history_pos])
-            self.set_edit_pos(len(self.edit_text))
-        elif key == 'down':
-            # Cycle forwards in history.
-            if self.history_pos == 1:
-                self.history_pos = 0
-                return False
-            elif self.history_pos == 0:
-                util.beep()
-                return
-
-            self.history_pos = util.limit(self.history_pos - 1,
-                                          1, len(self.history))
-            self.set_edit_text(
-                self.history[-self.history_pos])
-            self.set_edit_pos(len(self.edit_text))
-            return
-        else:
-            return super(ConsoleEdit, self).keypress(size, key)
-
-
-class ScrollingTextOverlay(urwid.Overlay):
-    def __init__(self, content, bottom_widget):
-        """
-        Parameters
-        ----------
-        content : str
-            The contents to display in the overlay widget.
-        bottom_widget : urwid.Widget
-            The original widget that the overlay appears over.
-        """
-        listbox = urwid.ListBox([urwid.Text(content)])
-        frame = urwid.Frame(listbox,
-                            header=urwid.AttrMap(
-                                urwid.Text(help_status_str), 'statusbar'))
-
-        super(ScrollingTextOverlay, self).__init__(
-            frame, bottom_widget,
-            align='center', width=('relative', 100),
-            valign='top', height=('relative', 100),
-            left=0, right=0,
-            top=0, bottom=0)
-
-    def keypress(self, size, key):
-        if key == 'j':
-            key = 'down'
-        elif key == 'k':
-            key = 'up'
-        elif key == 'ctrl d':
-            key = 'page down'
-        elif key == 'ctrl u':
-            key = 'page up'
-        return super(ScrollingTextOverlay, self).keypress(size, key)
+def __getattr__(name):
+    # The interface classes used to live here, import them on first use.
+    if name in ('Sermon', 'MultiSermon'):
+        import sermon.ui
+        return getattr(sermon.ui, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
-class Sermon(object):
+def parse_args(argv=None):
     """
-    The main serial monitor class. Starts a read thread that polls the serial
-    device and prints results to top window. Sends commands to serial device
-    after they have been executed in the curses textpad.
+    Parses and validates command line arguments.
+
+    Parameters
+    ----------
+    argv : list of str or None
+        Arguments to parse, defaults to sys.argv[1:].
+
+    Returns
+    -------
+    args : argparse.Namespace
+        The parsed arguments with parity, stopbits and durations converted to
+        the values used internally.
     """
-    def __init__(self, device, args):
-        # Receive display widgets
-        self.receive_window = urwid.Text('')
-        body = urwid.ListBox([self.receive_window, urwid.Text('')])
-        body.set_focus(1)
-
-        # Draw main frame with status header and footer for commands.
-        self.conection_msg = urwid.Text('', 'left')
-        self.status_msg = urwid.Text('', 'right')
-        self.header = urwid.Columns([self.conection_msg, self.status_msg])
-        self.frame = urwid.Frame(
-            body,
-            header=urwid.AttrMap(self.header, 'statusbar'),
-            footer=ConsoleEdit(self.on_edit_done, ': '),
-            focus_part='footer')
-        palette = [
-            ('error', 'light red', 'black'),
-            ('ok', 'dark green', 'black'),
-            ('statusbar', '', 'black')
-        ]
-        self.loop = urwid.MainLoop(self.frame, palette,
-                                   unhandled_input=self.unhandled_key_handler)
-
-        self.fd = self.loop.watch_pipe(self.received_data)
-
-        self.kill = False
-        self.append_text = args.append.encode(
-            'latin1').decode('unicode_escape')
-        self.frame_text = args.frame.encode('latin1').decode('unicode_escape')
-        self.byte_list_pattern = re.compile(
-            '(\$\(([^\)]+?)\))|(\${([^\)]+?)})')
-        self.device = device
-        self.serial = serial.Serial(device,
-                                    baudrate=args.baud,
-                                    bytesize=args.bytesize,
-                                    parity=args.parity,
-                                    stopbits=args.stopbits,
-                                    xonxoff=args.xonxoff,
-                                    rtscts=args.rtscts,
-                                    dsrdtr=args.dsrdtr,
-                                    timeout=0.1)
-        time.sleep(0.1)
-        self.serial.flushInput()
-        self.conection_msg.set_text(('ok', self.serial.name))
-
-        self.worker = threading.Thread(target=self.serial_read_worker)
-        self.worker.daemon = True
-
-        self.logging = False
-        self.logfile = None
-        magic.app = self
-
-    def update_status(self, status, text):
-        self.status_msg.set_text((status, text))
-
-    def unhandled_key_handler(self, key):
-        if key in ('q', 'esc'):
-            self.loop.widget = self.frame
-
-    def on_edit_done(self, edit_text):
-        """
-        Callback called when editing is completed (after enter is pressed)
-        """
-        if len(edit_text) < 1:
-            self.update_status('ok', '')
-            return
-        if edit_text[0] == '%':
-            # Handle magic command.
-            try:
-                result = magic.execute(edit_text[1:])
-                if result['status'] is not None:
-                    self.update_status('ok', result['status'])
-                if result['bytes_to_send'] is not None:
-                    self.serial.write(result['bytes_to_send'])
-            except (util.ArgumentParseError, AttributeError, ValueError) as e:
-                self.update_status('error', str(e))
-            return
-        if self.logging:
-            self.update_status('ok', 'Logging to %s' % self.logfile)
-        processed_command = ('%(frame)s%(command)s%(append)s%(frame)s' %
-                             {'frame': self.frame_text,
-                              'append': self.append_text,
-                              'command': edit_text})
-        # matches list of bytes $(0x08, 0x09, ... )
-        strings = self.byte_list_pattern.split(processed_command)
-        n = 0
-        while n < len(strings) - 1:
-            if strings[n] is None or strings[n] == '':
-                n += 1
-            elif self.byte_list_pattern.match(strings[n]):
-                # list of bytes
-                self.write_list_of_bytes(strings[n+1])
-                n += 2
-            else:
-                self.serial.write(strings[n].encode('latin1'))
-                n += 1
-        self.serial.write(strings[-1].encode('latin1'))
-
-    def overlay(self, content):
-        """
-        Shows the given content in an overlay window above the main frame.
-
-        Parameters
-        ----------
-        content : str
-            The text content to display over the main frame.
-        """
-        self.loop.widget = ScrollingTextOverlay(content, self.frame)
-
-    def received_data(self, data):
-        self.receive_window.set_text(self.receive_window.text +
-                                     data.decode('latin1'))
-        if self.logging:
-            try:
-                with open(self.logfile, 'a') as f:
-                    f.write(data.decode('latin1'))
-            except:
-                self.update_status('error', 'Error writing to logfile.')
-
-    def serial_read_worker(self):
-        """
-        Reads serial device and prints results to upper curses window.
-        """
-        while not self.kill:
-            data = self.serial.read()
-            if len(data) > 0:
-                # Need to reverse \r and \n for curses, otherwise it just
-                # clears the current line instead of making a new line. Also,
-                # translate single \n to \n\r so curses returns to the first
-                # column.
-                try:
-                    if data == b'\r':
-                        continue
-                    else:
-                        os.write(self.fd, data)
-                except UnicodeEncodeError or TypeError:
-                    # Handle null bytes in string.
-                    raise
-
-    def write_list_of_bytes(self, string):
-        byte_data = [int(s.strip(), 0) for s in string.split(',')]
-        self.serial.write(bytearray(byte_data))
-
-    def start(self):
-        self.worker.start()
-        self.loop.run()
-
-    def stop(self):
-        self.kill = True
-        while self.worker.is_alive():
-            pass
-        self.serial.close()
-
-    def exit(self):
-        self.stop()
-        raise urwid.ExitMainLoop()
-
-
-def main():
-    # Setup command line arguments
     parser = argparse.ArgumentParser(
         description='Monitors specified serial device.')
     parser.add_argument('-v', '--version',
@@ -334,12 +104,243 @@ def main():
     parser.add_argument('--dsrdtr',
                         action='store_true',
                         help='Enable hardware (DSR/DTR) flow control.')
-    parser.add_argument('device',
-                        default=False,
-                        help='Device name or path.',
-                        nargs='?')
+    parser.add_argument('--scrollback-lines',
+                        default=10000,
+                        type=int,
+                        help='Number of received lines to keep, '
+                             'defaults to 10000.')
+    parser.add_argument('--scrollback-bytes',
+                        default=10485760,
+                        type=int,
+                        help='Number of received bytes to keep, '
+                             'defaults to 10485760.')
+    parser.add_argument('--read-chunk',
+                        default=4096,
+                        type=int,
+                        help='Maximum number of bytes read from the device '
+                             'at once, defaults to 4096.')
+    parser.add_argument('--fps',
+                        default=30,
+                        type=float,
+                        help='Maximum number of times per second the '
+                             'received data display is refreshed, '
+                             'defaults to 30.')
+    parser.add_argument('--stats-log',
+                        default=None,
+                        help='Append throughput statistics to the given file '
+                             'as JSON lines.')
+    parser.add_argument('--stats-interval',
+                        default='1s',
+                        help='Interval between --stats-log entries, defaults '
+                             'to 1s.')
+    parser.add_argument('--hex',
+                        action='store_true',
+                        help='Display received data as a hex dump.')
+    parser.add_argument('--timestamps',
+                        choices=['abs', 'delta'],
+                        default=None,
+                        help='Prefix received lines with the time they '
+                             'arrived, or the time since the previous line.')
+    parser.add_argument('--telemetry',
+                        choices=['csv', 'kv'],
+                        default=None,
+                        help='Parse numbers from received CSV or key=value '
+                             'lines and show them with sparklines.')
+    parser.add_argument('--telemetry-samples',
+                        default=4096,
+                        type=int,
+                        help='Number of telemetry rows kept for each field, '
+                             'defaults to 4096.')
+    parser.add_argument('--rx-protocol',
+                        choices=['hdlc', 'slip', 'cobs', 'lenprefix'],
+                        default=None,
+                        help='Split received data into frames of the given '
+                             'protocol, each displayed on its own line.')
+    parser.add_argument('--rx-crc',
+                        choices=sorted(crcs.keys()),
+                        default=None,
+                        help='Checksum expected at the end of received '
+                             'frames.')
+    parser.add_argument('--tx-protocol',
+                        choices=['hdlc', 'slip', 'cobs', 'lenprefix'],
+                        default=None,
+                        help='Send commands and file chunks as frames of the '
+                             'given protocol.')
+    parser.add_argument('--tx-crc',
+                        choices=sorted(crcs.keys()),
+                        default=None,
+                        help='Checksum appended to sent frames.')
+    parser.add_argument('--length-bytes',
+                        choices=[1, 2, 4],
+                        default=2,
+                        type=int,
+                        help='Size of the lenprefix length header, defaults '
+                             'to 2.')
+    parser.add_argument('--length-order',
+                        choices=['big', 'little'],
+                        default='big',
+                        help='Byte order of the lenprefix length header, '
+                             'defaults to big.')
+    parser.add_argument('--replay',
+                        default=None,
+                        metavar='FILE',
+                        help='Replay the data received in a capture file '
+                             'instead of opening a device.')
+    parser.add_argument('--replay-speed',
+                        default='1',
+                        help='Replay speed relative to the original timing, '
+                             'or max for as fast as possible, defaults to 1.')
+    parser.add_argument('--serve',
+                        default=None,
+                        metavar='HOST:PORT',
+                        help='Share the device with TCP clients connecting '
+                             'to the given address.')
+    parser.add_argument('--cat',
+                        default=None,
+                        metavar='FILE',
+                        help='Write the data in a log compressed with '
+                             '%%logstart --compress to stdout and exit.')
+    parser.add_argument('--from',
+                        dest='cat_from',
+                        default=None,
+                        metavar='TIME',
+                        help='With --cat, start at data logged at this time, '
+                             'e.g. 13:45 or 2024-05-01T13:45:00.')
+    parser.add_argument('--to',
+                        dest='cat_to',
+                        default=None,
+                        metavar='TIME',
+                        help='With --cat, stop after data logged at this '
+                             'time.')
+    parser.add_argument('--headless',
+                        action='store_true',
+                        help='Stream received data to stdout and send lines '
+                             'read from stdin, without the interactive UI.')
+    parser.add_argument('devices',
+                        metavar='device',
+                        help='Device name or path, or a URL like '
+                             'tcp://host:port. Several devices are shown '
+                             'in tabs.',
+                        nargs='*')
+
+    commandline_args = parser.parse_args(argv)
+    commandline_args.device = (commandline_args.devices[0]
+                               if commandline_args.devices else False)
+    if (commandline_args.scrollback_lines < 1 or
+            commandline_args.scrollback_bytes < 1):
+        parser.error('scrollback limits must be positive.')
+    if commandline_args.telemetry_samples < 1:
+        parser.error('telemetry samples must be positive.')
+    if commandline_args.read_chunk < 1:
+        parser.error('read chunk must be positive.')
+    if commandline_args.fps <= 0:
+        parser.error('fps must be positive.')
+    try:
+        commandline_args.stats_interval = util.parse_duration(
+            commandline_args.stats_interval)
+    except ValueError as e:
+        parser.error(str(e))
+    if commandline_args.stats_interval <= 0:
+        parser.error('stats interval must be positive.')
+    if commandline_args.rx_crc is not None and \
+            commandline_args.rx_protocol is None:
+        parser.error('--rx-crc requires --rx-protocol.')
+    if commandline_args.tx_crc is not None and \
+            commandline_args.tx_protocol is None:
+        parser.error('--tx-crc requires --tx-protocol.')
+    if commandline_args.timestamps is not None and \
+            commandline_args.rx_protocol is not None:
+        parser.error('--timestamps can not be combined with --rx-protocol.')
+    if commandline_args.telemetry is not None and commandline_args.headless:
+        parser.error('--telemetry can not be used in headless mode.')
+    if commandline_args.frame and commandline_args.tx_protocol is not None:
+        parser.error('--frame can not be combined with --tx-protocol.')
+    if commandline_args.serve is not None:
+        from sermon.bridge import parse_address
+        try:
+            commandline_args.serve = parse_address(commandline_args.serve)
+        except ValueError as e:
+            parser.error(str(e))
+    if commandline_args.cat is None and \
+            (commandline_args.cat_from is not None or
+             commandline_args.cat_to is not None):
+        parser.error('--from and --to require --cat.')
+    if commandline_args.replay is not None:
+        if commandline_args.device:
+            parser.error('a device can not be given with --replay.')
+        commandline_args.device = commandline_args.replay
+        commandline_args.devices = [commandline_args.replay]
+    if commandline_args.replay_speed == 'max':
+        commandline_args.replay_speed = 0
+    else:
+        try:
+            commandline_args.replay_speed = float(
+                commandline_args.replay_speed)
+        except ValueError:
+            parser.error('invalid replay speed: %s' %
+                         commandline_args.replay_speed)
+        if commandline_args.replay_speed <= 0:
+            parser.error('replay speed must be positive.')
+    commandline_args.parity = parity_values[commandline_args.parity]
+    commandline_args.stopbits = stopbits_values[commandline_args.stopbits]
 
-    commandline_args = parser.parse_args()
+    # -l, -v and --cat exit without opening a device, so the options for
+    # monitoring one don't apply.
+    if commandline_args.list or commandline_args.version or \
+            commandline_args.cat is not None:
+        return commandline_args
+    if not commandline_args.device and commandline_args.headless:
+        parser.error('a device is required in headless mode.')
+    if len(commandline_args.devices) > 1:
+        if commandline_args.headless:
+            parser.error('headless mode supports a single device.')
+        if commandline_args.serve is not None:
+            parser.error('--serve supports a single device.')
+    if commandline_args.stats_log is not None:
+        # Checked before any port is opened, each device of several gets
+        # its own file.
+        filenames = [commandline_args.stats_log]
+        if len(commandline_args.devices) > 1:
+            filenames = ['%s.%d' % (commandline_args.stats_log, n + 1)
+                         for n in range(len(commandline_args.devices))]
+        for filename in filenames:
+            try:
+                open(filename, 'a').close()
+            except (IOError, OSError) as e:
+                parser.error('can not open statistics log %s: %s' %
+                             (filename, e.strerror))
+    return commandline_args
+
+
+def cat_log(filename, start=None, end=None):
+    """
+    Writes the data of a compressed log between two times to stdout.
+
+    Returns
+    -------
+    status : int
+        The exit status.
+    """
+    from sermon.blocklog import BlockLog
+
+    try:
+        log = BlockLog(filename)
+        if start is not None:
+            start = util.parse_time(start, log.started)
+        if end is not None:
+            end = util.parse_time(end, log.started)
+        log.cat(sys.stdout.buffer, start, end)
+        sys.stdout.flush()
+    except ValueError as e:
+        print('Error: %s' % e, file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        pass
+    return 0
+
+
+def main():
+    commandline_args = parse_args()
 
     # List serial devices and exit for argument '-l'
     if commandline_args.list:
@@ -348,6 +349,9 @@ def main():
     elif commandline_args.version:
         print(sermon.__version__)
         sys.exit()
+    elif commandline_args.cat is not None:
+        sys.exit(cat_log(commandline_args.cat, commandline_args.cat_from,
+                         commandline_args.cat_to))
 
     # If device is not specified, prompt user to select an available device.
     device = None
@@ -374,12 +378,23 @@ def main():
     else:
         device = commandline_args.device
 
-    commandline_args.parity = parity_values[commandline_args.parity]
-    commandline_args.stopbits = stopbits_values[commandline_args.stopbits]
+    if commandline_args.headless:
+        from sermon.headless import Headless
+        try:
+            app = Headless(device, commandline_args)
+        except (serial.serialutil.SerialException, ValueError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        app.run()
+        return
 
+    from sermon.ui import Sermon, MultiSermon
     try:
-        app = Sermon(device, commandline_args)
-    except serial.serialutil.SerialException as e:
+        if len(commandline_args.devices) > 1:
+            app = MultiSermon(commandline_args.devices, commandline_args)
+        else:
+            app = Sermon(device, commandline_args)
+    except (serial.serialutil.SerialException, ValueError) as e:
         print(e)
         sys.exit(1)
 
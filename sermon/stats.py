@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput and latency counters.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import threading
+import time
+
+
+def format_bytes(n):
+    """
+    Formats a byte count compactly, e.g. 950, 12.3k or 4.1M.
+    """
+    for unit in ('', 'k', 'M'):
+        if abs(n) < 1000:
+            return ('%d%s' if unit == '' else '%.1f%s') % (n, unit)
+        n /= 1000
+    return '%.1fG' % n
+
+
+class Stats(object):
+    """
+    Counters updated by the reader, UI, logger and writer paths. Every
+    counter has a single thread incrementing it, so no locking is needed.
+    Gauges like queue depths are read on demand from callables registered in
+    `gauges`.
+    """
+    counters = ('rx_bytes', 'rx_chunks', 'rx_chunk_max', 'rx_waiting_max',
+                'flushes', 'flush_chunks_max', 'flush_latency',
+                'flush_latency_max', 'redraws', 'redraw_time',
+                'redraw_time_max')
+
+    def __init__(self):
+        self.started = time.monotonic()
+        for name in self.counters:
+            setattr(self, name, 0)
+        self.gauges = {}
+        self._dump_thread = None
+
+    def record_read(self, nbytes, waiting):
+        """
+        Called by the reader for every chunk read.
+
+        Parameters
+        ----------
+        nbytes : int
+            Size of the chunk.
+        waiting : int
+            Bytes that were waiting in the OS input buffer when it was read.
+        """
+        self.rx_bytes += nbytes
+        self.rx_chunks += 1
+        if nbytes > self.rx_chunk_max:
+            self.rx_chunk_max = nbytes
+        if waiting > self.rx_waiting_max:
+            self.rx_waiting_max = waiting
+
+    def record_flush(self, nchunks, latency):
+        """
+        Called by the UI for every flush of buffered received data.
+
+        Parameters
+        ----------
+        nchunks : int
+            Number of chunks that were waiting.
+        latency : float
+            Seconds the oldest of them waited.
+        """
+        self.flushes += 1
+        self.flush_latency += latency
+        if nchunks > self.flush_chunks_max:
+            self.flush_chunks_max = nchunks
+        if latency > self.flush_latency_max:
+            self.flush_latency_max = latency
+
+    def record_redraw(self, seconds):
+        """
+        Called by the UI after every screen redraw.
+        """
+        self.redraws += 1
+        self.redraw_time += seconds
+        if seconds > self.redraw_time_max:
+            self.redraw_time_max = seconds
+
+    def snapshot(self):
+        """
+        Returns the current value of all counters and gauges.
+        """
+        snapshot = dict((name, getattr(self, name)) for name in self.counters)
+        for name, gauge in self.gauges.items():
+            snapshot[name] = gauge()
+        snapshot['time'] = time.monotonic() - self.started
+        return snapshot
+
+    def rates(self, previous=None):
+        """
+        Returns a snapshot including the receive and transmit rates in bytes
+        per second since the `previous` snapshot, or since the start.
+        """
+        snapshot = self.snapshot()
+        previous = previous or {'time': 0}
+        elapsed = snapshot['time'] - previous['time']
+        for name in ('rx_bytes', 'tx_bytes'):
+            if name in snapshot and elapsed > 0:
+                rate = (snapshot[name] - previous.get(name, 0)) / elapsed
+            else:
+                rate = 0
+            snapshot[name[:2] + '_rate'] = rate
+        return snapshot
+
+    def summary_str(self, snapshot):
+        """
+        Compact readout for the status bar.
+        """
+        text = 'rx %sB/s' % format_bytes(snapshot['rx_rate'])
+        if 'tx_rate' in snapshot:
+            text += ' tx %sB/s' % format_bytes(snapshot['tx_rate'])
+        return text
+
+    def report_str(self):
+        """
+        Multi line report for the %stats overlay.
+        """
+        s = self.snapshot()
+        lines = ['Sermon Statistics', '',
+                 'Session            %.1f s' % s['time'],
+                 'Received           %sB in %d chunks, %sB/s average' % (
+                     format_bytes(s['rx_bytes']), s['rx_chunks'],
+                     format_bytes(s['rx_bytes'] / max(s['time'], 1e-9))),
+                 'Largest chunk      %d bytes' % s['rx_chunk_max'],
+                 'Input buffer peak  %d bytes' % s['rx_waiting_max'],
+                 'Flushes            %d, peak backlog %d chunks' % (
+                     s['flushes'], s['flush_chunks_max'])]
+        if s['flushes'] > 0:
+            lines.append('Display latency    %.2f ms average, %.2f ms peak' % (
+                1000 * s['flush_latency'] / s['flushes'],
+                1000 * s['flush_latency_max']))
+        if s['redraws'] > 0:
+            lines.append('Redraws            %d, %.2f ms average, '
+                         '%.2f ms peak' % (
+                             s['redraws'],
+                             1000 * s['redraw_time'] / s['redraws'],
+                             1000 * s['redraw_time_max']))
+        for name in sorted(self.gauges):
+            lines.append('%-18s %s' % (name.replace('_', ' ').capitalize(),
+                                       s[name]))
+        return '\n'.join(lines)
+
+    def start_dump(self, filename, interval, stop_event):
+        """
+        Appends a JSON line with all counters and gauges to `filename` every
+        `interval` seconds from a background thread, until `stop_event` is
+        set. Running on its own thread, gaps or growing backlogs in the dump
+        show when the rest of the application falls behind.
+        """
+        f = open(filename, 'a')
+
+        def dump():
+            previous = None
+            with f:
+                while not stop_event.wait(interval):
+                    previous = self.rates(previous)
+                    f.write(json.dumps(previous, sort_keys=True) + '\n')
+                    f.flush()
+
+        self._dump_thread = threading.Thread(target=dump)
+        self._dump_thread.daemon = True
+        self._dump_thread.start()
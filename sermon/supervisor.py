@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+Recovers from lost serial devices.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import time
+
+import serial
+
+import sermon.util as util
+
+
+class Reconnector(object):
+    """
+    Reopens a serial device after it was lost, e.g. when a USB adapter is
+    unplugged, retrying with exponential backoff and the port settings given
+    on the command line. Waiting is done on the stop event, so shutting down
+    interrupts any retry immediately.
+    """
+    def __init__(self, device, args, stop_event, initial_delay=0.1,
+                 max_delay=5.0):
+        """
+        Parameters
+        ----------
+        device : str
+            Device name, path or URL.
+        args : argparse.Namespace
+            Parsed command line arguments used to open the device.
+        stop_event : threading.Event
+            Set when the application is shutting down.
+        initial_delay : float
+            Seconds to wait before the first attempt.
+        max_delay : float
+            Maximum number of seconds between attempts.
+        """
+        self.device = device
+        self.args = args
+        self.stop_event = stop_event
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.attempts = 0
+        self.reconnects = 0
+        self.lost_at = None
+        self.last_downtime = None
+
+    @property
+    def connected(self):
+        return self.lost_at is None
+
+    @property
+    def downtime(self):
+        """
+        Seconds since the device was lost, or the length of the last outage
+        if it is connected.
+        """
+        if self.lost_at is None:
+            return self.last_downtime
+        return time.monotonic() - self.lost_at
+
+    def status_str(self):
+        """
+        Short description of the connection state for the status bar.
+        """
+        if not self.connected:
+            return '%s lost, retry %d (%.1fs)' % (self.device, self.attempts,
+                                                 self.downtime)
+        if self.reconnects > 0:
+            return '%s (reconnected %dx, down %.1fs)' % (
+                self.device, self.reconnects, self.last_downtime)
+        return self.device
+
+    def reconnect(self, old_serial=None):
+        """
+        Blocks until the device has been reopened or the stop event is set.
+
+        Parameters
+        ----------
+        old_serial : serial.Serial or None
+            The lost port, closed before retrying.
+
+        Returns
+        -------
+        ser : serial.Serial or None
+            The reopened port, None if stopped first.
+        """
+        if old_serial is not None:
+            try:
+                old_serial.close()
+            except (serial.SerialException, OSError):
+                pass
+        self.lost_at = time.monotonic()
+        self.attempts = 0
+        delay = self.initial_delay
+        while not self.stop_event.wait(delay):
+            self.attempts += 1
+            try:
+                ser = util.open_serial(self.device, self.args)
+            except (serial.SerialException, OSError):
+                delay = min(2 * delay, self.max_delay)
+                continue
+            self.last_downtime = time.monotonic() - self.lost_at
+            self.lost_at = None
+            self.reconnects += 1
+            return ser
+        return None
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""
+Numeric telemetry parsed from received lines.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import math
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+
+
+kv_pattern = re.compile(br'([A-Za-z_][\w.\-]*)\s*=\s*'
+                        br'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+spark_characters = '▁▂▃▄▅▆▇█'
+
+# Binary export: magic, then the number of fields and rows.
+magic = b'SERMTLM1'
+export_header = struct.Struct('<II')
+
+
+def sparkline(values, width):
+    """
+    Draws the last `width` values as a line of block characters scaled
+    between their minimum and maximum, missing (NaN) values as spaces.
+    """
+    values = values[-width:]
+    present = [v for v in values if v == v]
+    if len(present) == 0:
+        return ' ' * len(values)
+    low = min(present)
+    span = max(present) - low
+    top = len(spark_characters) - 1
+    chars = []
+    for v in values:
+        if v != v:
+            chars.append(' ')
+        elif span == 0:
+            chars.append(spark_characters[top // 2])
+        else:
+            chars.append(spark_characters[int((v - low) / span * top + 0.5)])
+    return ''.join(chars)
+
+
+def format_value(value):
+    if value != value:
+        return '-'
+    return '%.6g' % value
+
+
+class Telemetry(object):
+    """
+    Parses CSV or key=value lines from received data into ring buffers. Rows
+    are kept in one `array('d')` per field plus one for the read times, all
+    of `capacity` entries, so samples are stored as raw doubles without any
+    Python object per sample and memory stays fixed however long the session
+    runs. A field missing from a row, or appearing only later, reads as NaN.
+
+    `feed` is called by the reader thread with every received chunk, so
+    parsing never holds up the UI, which only takes a copy of the buffers a
+    few times a second to draw its readout. In 'csv' mode a first line that
+    isn't all numbers names the columns, otherwise they are numbered from 1.
+    Lines that can't be parsed are counted in `skipped`.
+    """
+    def __init__(self, mode, capacity=4096, max_fields=32):
+        """
+        Parameters
+        ----------
+        mode : str
+            'csv' or 'kv'.
+        capacity : int
+            Number of rows kept.
+        max_fields : int
+            Further fields are ignored, so noise can't use up memory.
+        """
+        self.mode = mode
+        self.capacity = capacity
+        self.max_fields = max_fields
+        self.names = []
+        self.rows = 0
+        self.skipped = 0
+        self.offset = time.time() - time.monotonic()
+        self._columns = {}
+        self._buffers = []
+        self._times = array('d', bytes(8 * capacity))
+        self._head = 0
+        self._pending = b''
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Number of rows in the buffers.
+        """
+        return min(self.rows, self.capacity)
+
+    def feed(self, data, timestamp):
+        """
+        Parses the lines completed by data, read at monotonic time
+        `timestamp`.
+        """
+        lines = (self._pending + data).split(b'\n')
+        self._pending = lines.pop()[-4096:]
+        if len(lines) == 0:
+            return
+        parse = self._parse_kv if self.mode == 'kv' else self._parse_csv
+        with self._lock:
+            for line in lines:
+                parse(line.strip(), timestamp)
+
+    def _parse_csv(self, line, timestamp):
+        if len(line) == 0:
+            return
+        fields = line.split(b',')
+        try:
+            values = [float(field) for field in fields]
+        except ValueError:
+            if self.rows == 0 and len(self.names) == 0:
+                for field in fields:
+                    self._column(field.strip().decode('latin1'))
+            else:
+                self.skipped += 1
+            return
+        while len(self.names) < len(values) and \
+                len(self.names) < self.max_fields:
+            self._column(str(len(self.names) + 1))
+        self._append(range(min(len(values), len(self.names))), values,
+                     timestamp)
+
+    def _parse_kv(self, line, timestamp):
+        pairs = kv_pattern.findall(line)
+        if len(pairs) == 0:
+            if len(line) > 0:
+                self.skipped += 1
+            return
+        columns = []
+        values = []
+        for key, value in pairs:
+            column = self._columns.get(key)
+            if column is None:
+                column = self._column(key.decode('latin1'))
+                if column is None:
+                    continue
+            columns.append(column)
+            values.append(float(value))
+        self._append(columns, values, timestamp)
+
+    def _column(self, name):
+        """
+        Adds a field, returns its column or None if there are too many.
+        """
+        if len(self.names) >= self.max_fields:
+            return None
+        self.names.append(name)
+        self._columns[name.encode('latin1')] = len(self._buffers)
+        self._buffers.append(array('d', [float('nan')]) * self.capacity)
+        return len(self._buffers) - 1
+
+    def _append(self, columns, values, timestamp):
+        head = self._head
+        self._times[head] = timestamp
+        written = set(columns)
+        nan = float('nan')
+        for column, buffer in enumerate(self._buffers):
+            if column not in written:
+                buffer[head] = nan
+        for column, value in zip(columns, values):
+            self._buffers[column][head] = value
+        self._head = (head + 1) % self.capacity
+        self.rows += 1
+
+    def snapshot(self, count=None):
+        """
+        Copies the newest `count` rows, or all of them, oldest first.
+
+        Returns
+        -------
+        times, columns : array, list of array
+            The read times as wall clock seconds, and the values of each
+            field in the order of `names`.
+        """
+        with self._lock:
+            n = len(self)
+            if count is not None:
+                n = min(n, count)
+            start = (self._head - n) % self.capacity
+            buffers = [self._times] + self._buffers
+            if start + n <= self.capacity:
+                copies = [b[start:start + n] for b in buffers]
+            else:
+                copies = [b[start:] + b[:self._head] for b in buffers]
+        times = array('d', [t + self.offset for t in copies[0]])
+        return times, copies[1:]
+
+    def readout_lines(self, width):
+        """
+        Returns a line for each field with its last value, minimum, maximum
+        and mean over the buffers, followed by a sparkline of the newest
+        values filling the rest of `width`.
+        """
+        if len(self.names) == 0:
+            return ['telemetry: waiting for %s lines' % self.mode]
+        times, columns = self.snapshot()
+        name_width = min(max(len(name) for name in self.names), 16)
+        lines = []
+        for name, values in zip(self.names, columns):
+            present = [v for v in values if v == v]
+            if len(present) > 0:
+                stats = '%10s  min %-10s max %-10s mean %-10s' % (
+                    format_value(present[-1]), format_value(min(present)),
+                    format_value(max(present)),
+                    format_value(math.fsum(present) / len(present)))
+            else:
+                stats = '%10s' % '-'
+            text = '%-*s %s ' % (name_width, name[:name_width], stats)
+            lines.append(text + sparkline(values,
+                                          max(0, width - len(text))))
+        return lines
+
+    def export(self, filename, binary=False):
+        """
+        Writes all buffered rows to a file. CSV files have a header row with
+        'time' and the field names, then one row per sample, missing values
+        left empty. Binary files start with the magic b'SERMTLM1', the
+        number of fields and of rows as little endian uint32 and the
+        newline separated field names prefixed with their uint32 length,
+        followed by the times and then each field as a column of little
+        endian float64.
+
+        Returns
+        -------
+        rows : int
+            Number of rows written.
+
+        Raises
+        ------
+        IOError, OSError
+            If the file can't be written.
+        """
+        times, columns = self.snapshot()
+        names = list(self.names[:len(columns)])
+        if binary:
+            encoded = '\n'.join(names).encode('utf-8')
+            with open(filename, 'wb') as f:
+                f.write(magic)
+                f.write(export_header.pack(len(columns), len(times)))
+                f.write(struct.pack('<I', len(encoded)))
+                f.write(encoded)
+                for column in [times] + columns:
+                    if sys.byteorder != 'little':
+                        column.byteswap()
+                    column.tofile(f)
+            return len(times)
+        with open(filename, 'w') as f:
+            f.write(','.join(['time'] + names) + '\n')
+            for row in zip(times, *columns):
+                f.write('%.6f' % row[0])
+                f.write(''.join([',' + repr(v) if v == v else ','
+                                 for v in row[1:]]))
+                f.write('\n')
+        return len(times)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timestamp prefixes for received lines.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import time
+
+
+class LineTimestamper(object):
+    """
+    Prefixes every received line with the time its first byte was read.
+    Chunks are stamped with `time.monotonic()` by the reader as they are
+    read, so the prefixes don't depend on when the display is refreshed.
+    Lines starting in the same chunk share its timestamp.
+
+    In 'abs' mode the prefix is the local wall clock time, in 'delta' mode
+    the number of seconds since the previous line started.
+    """
+    def __init__(self, mode='abs'):
+        """
+        Parameters
+        ----------
+        mode : str
+            'abs' or 'delta'.
+        """
+        self.mode = mode
+        # Offset converting monotonic timestamps to wall clock time.
+        self.offset = time.time() - time.monotonic()
+        self.last = None
+        self._line_start = True
+
+    def prefix(self, timestamp):
+        """
+        Returns the prefix for a line starting at monotonic time
+        `timestamp`.
+        """
+        if self.mode == 'delta':
+            delta = timestamp - self.last if self.last is not None else 0
+            self.last = timestamp
+            return b'[+%.6f] ' % delta
+        self.last = timestamp
+        wall = timestamp + self.offset
+        return ('[%s.%06d] ' % (time.strftime('%H:%M:%S',
+                                              time.localtime(wall)),
+                                int(wall % 1 * 1e6))).encode('ascii')
+
+    def stamp(self, data, timestamp):
+        """
+        Returns `data` with a prefix inserted at the start of every line
+        that begins in it.
+        """
+        if len(data) == 0:
+            return data
+        pieces = data.split(b'\n')
+        last = len(pieces) - 1
+        parts = []
+        for n, piece in enumerate(pieces):
+            if n > 0:
+                parts.append(b'\n')
+            if (n > 0 or self._line_start) and (len(piece) > 0 or n < last):
+                parts.append(self.prefix(timestamp))
+            parts.append(piece)
+        self._line_start = len(pieces[-1]) == 0
+        return b''.join(parts)
+
+    def stamp_chunks(self, chunks, timestamps):
+        """
+        Stamps a list of chunks with their read times and joins them.
+        """
+        return b''.join([self.stamp(chunk, timestamp)
+                         for chunk, timestamp in zip(chunks, timestamps)])
+
+    def reset(self):
+        """
+        Starts a new line, e.g. after the display switched modes.
+        """
+        self._line_start = True
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streams files to the serial device.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import threading
+import time
+
+
+class FileTransfer(object):
+    """
+    Sends a file through a `SerialWriter` in chunks from a background thread,
+    so the whole file is never held in memory. At most `window` bytes are
+    queued ahead of the device, each chunk can be followed by a delay, and
+    with `drain` each chunk waits until the port's output buffer is empty,
+    which respects any hardware or software flow control. With a frame
+    encoder every chunk is sent as one frame.
+    """
+    def __init__(self, filename, writer, chunk_size=4096, delay=0,
+                 drain=False, window=None, framer=None):
+        """
+        Parameters
+        ----------
+        filename : str
+            Path of the file to send.
+        writer : SerialWriter
+            The writer chunks are queued on.
+        chunk_size : int
+            Number of bytes read and queued at once.
+        delay : float
+            Seconds to wait after each chunk has been written.
+        drain : bool
+            Wait for the port's output buffer to empty after each chunk.
+        window : int or None
+            Maximum number of bytes queued ahead of the device, defaults to
+            two chunks.
+        framer : sermon.framing.FrameEncoder or None
+            Encoder each chunk is framed with.
+        """
+        self.filename = filename
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.drain = drain
+        self.window = window if window is not None else 2 * chunk_size
+        self.framer = framer
+        self.error = None
+        self.cancelled = False
+        self.queued = 0
+        self.position = 0
+        self.started = None
+        self.finished = None
+        self._file = open(filename, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        """
+        Starts sending in the background.
+        """
+        self.started = time.monotonic()
+        self._thread.start()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def sent(self):
+        """
+        Approximate number of bytes already written to the device.
+        """
+        if self.done:
+            return self.queued
+        return max(0, self.queued - self.writer.pending_bytes)
+
+    @property
+    def sent_file_bytes(self):
+        """
+        Approximate number of bytes of the file already written, which
+        differs from `sent` once chunks are framed.
+        """
+        if self.queued == 0:
+            return 0
+        return self.position * self.sent // self.queued
+
+    @property
+    def rate(self):
+        """
+        Average throughput in bytes per second.
+        """
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.sent / elapsed if elapsed > 0 else 0
+
+    def cancel(self):
+        """
+        Stops the transfer and discards the data it already queued, other
+        data queued on the writer is still sent.
+        """
+        self.cancelled = True
+        self._cancel.set()
+        self._thread.join()
+
+    def progress_str(self):
+        """
+        Short progress readout for the status bar.
+        """
+        if self.size > 0:
+            percent = 100 * self.sent_file_bytes / self.size
+        else:
+            percent = 100
+        return 'sending %s %d%% %.1f kB/s' % (os.path.basename(self.filename),
+                                              percent, self.rate / 1000)
+
+    def status_str(self):
+        """
+        Summary shown once the transfer has ended.
+        """
+        if self.error is not None:
+            return 'Error sending %s: %s' % (self.filename, self.error)
+        if self.cancelled:
+            return 'Cancelled sending %s after %d bytes' % (self.filename,
+                                                             self.sent)
+        return 'Sent %s (%d bytes, %.1f kB/s)' % (self.filename, self.sent,
+                                                  self.rate / 1000)
+
+    def _wait_for_writer(self, max_pending):
+        while not self.writer.wait(max_pending, 0.1):
+            if self._cancel.is_set():
+                return
+
+    def _drain_port(self):
+        try:
+            while (self.writer.serial.out_waiting > 0 and
+                   not self._cancel.is_set()):
+                time.sleep(0.001)
+        except (AttributeError, NotImplementedError):
+            # The port can't report its output buffer, rely on the writer.
+            self.drain = False
+
+    def _run(self):
+        try:
+            with self._file:
+                while not self._cancel.is_set():
+                    self._wait_for_writer(max(0, self.window -
+                                                  self.chunk_size))
+                    data = self._file.read(self.chunk_size)
+                    if len(data) == 0 or self._cancel.is_set():
+                        break
+                    self.position += len(data)
+                    if self.framer is not None:
+                        data = self.framer.encode(data)
+                    self.writer.write(data, cancel=self._cancel)
+                    self.queued += len(data)
+                    if self.drain or self.delay > 0:
+                        self._wait_for_writer(0)
+                    if self.drain:
+                        self._drain_port()
+                    if self.delay > 0:
+                        self._cancel.wait(self.delay)
+                self._wait_for_writer(0)
+        except (IOError, OSError, ValueError) as e:
+            self.error = e
+        finally:
+            self.finished = time.monotonic()
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+
+"""
+Watch patterns evaluated against every received byte.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import queue
+import re
+import time
+
+from sermon.logger import LogWriter
+
+
+regex_characters = set('.^$*+?{}[]\\|()')
+
+
+def is_literal(pattern):
+    """
+    True if a pattern has no regular expression special characters, so it
+    only matches itself.
+    """
+    return not any(c in regex_characters for c in pattern)
+
+
+class AhoCorasick(object):
+    """
+    Streaming multi-pattern matcher for literal byte strings. The patterns
+    are compiled into one deterministic automaton, so every byte costs a
+    single transition whatever the number of patterns, and the state is kept
+    between calls to `feed`, so matches spanning any number of chunks are
+    found. While the automaton is in its start state, bytes which can't
+    begin a pattern are skipped with a regular expression search instead of
+    being stepped through one by one.
+    """
+    def __init__(self, patterns):
+        """
+        Parameters
+        ----------
+        patterns : list of bytes
+            The non-empty literals to find, matches report their index.
+        """
+        goto = [{}]
+        outputs = [[]]
+        for n, pattern in enumerate(patterns):
+            state = 0
+            for byte in bytearray(pattern):
+                if byte not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][byte] = len(goto) - 1
+                state = goto[state][byte]
+            outputs[state].append(n)
+
+        # Resolve the failure links breadth first into full transitions: a
+        # state moves on every byte its failure state moves on, unless it has
+        # its own transition. Transitions back to the start state are left
+        # out, a missing byte means state 0.
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        order = list(goto[0].values())
+        for state in order:
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            for byte, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(byte, 0)
+                order.append(child)
+        self.delta = delta
+        self.outputs = [tuple(output) for output in outputs]
+        first = b''.join(re.escape(bytes(bytearray([byte])))
+                         for byte in sorted(goto[0]))
+        self.first = re.compile(b'[' + first + b']' if first else b'(?!)')
+        self.state = 0
+
+    def feed(self, data):
+        """
+        Returns the indices of all patterns ending in data, once for every
+        occurrence.
+        """
+        delta = self.delta
+        outputs = self.outputs
+        state = self.state
+        hits = []
+        position = 0
+        end = len(data)
+        while position < end:
+            if state == 0:
+                match = self.first.search(data, position)
+                if match is None:
+                    break
+                position = match.start()
+            state = delta[state].get(data[position], 0)
+            if outputs[state]:
+                hits.extend(outputs[state])
+            position += 1
+        self.state = state
+        return hits
+
+
+# Inline flags, named groups, backreferences and conditionals change meaning
+# or fail to compile once patterns are joined into one alternation.
+uncombinable = re.compile(br'\(\?[aiLmsux\-(]|\(\?P|\\[1-9]|\\g<')
+
+
+class RegexMatcher(object):
+    """
+    Matches several regular expressions against received lines. A line is
+    matched once complete, with a single search of all expressions combined
+    into one alternation, and only lines that search finds anything in are
+    searched with every expression to count the occurrences of each.
+    Expressions with inline flags, named groups or backreferences are left
+    out of the alternation and searched on their own.
+    """
+    def __init__(self, patterns, max_line=4096):
+        """
+        Parameters
+        ----------
+        patterns : list of bytes
+            The regular expressions.
+        max_line : int
+            Unfinished lines longer than this are matched as if complete.
+
+        Raises
+        ------
+        re.error
+            If an expression is invalid.
+        """
+        self.combined = None
+        self.grouped = []
+        self.separate = []
+        for n, pattern in enumerate(patterns):
+            if uncombinable.search(pattern):
+                self.separate.append((n, re.compile(pattern)))
+            else:
+                self.grouped.append((n, re.compile(pattern)))
+        if len(self.grouped) > 0:
+            self.combined = re.compile(b'|'.join(
+                b'(?:' + regex.pattern + b')' for _, regex in self.grouped))
+        self.max_line = max_line
+        self.pending = b''
+
+    def feed(self, data):
+        """
+        Returns (index, matched text) for every occurrence in the lines
+        completed by data.
+        """
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        if len(self.pending) > self.max_line:
+            lines.append(self.pending)
+            self.pending = b''
+        hits = []
+        search = self.combined.search if self.combined is not None else None
+        for line in lines:
+            if search is not None and search(line) is not None:
+                for n, regex in self.grouped:
+                    for match in regex.finditer(line):
+                        hits.append((n, match.group(0)))
+            for n, regex in self.separate:
+                for match in regex.finditer(line):
+                    hits.append((n, match.group(0)))
+        return hits
+
+
+class Trigger(object):
+    """
+    A watch pattern, its action and when it was seen.
+    """
+    def __init__(self, pattern, action, data=None):
+        """
+        Parameters
+        ----------
+        pattern : str
+            Literal text or regular expression.
+        action : str
+            'beep', 'log:FILE' or 'send:TEXT'.
+        data : bytes or None
+            The encoded bytes for a send action.
+        """
+        self.pattern = pattern
+        self.action = action
+        self.data = data
+        self.literal = is_literal(pattern)
+        self.hits = 0
+        self.first_seen = None
+        self.last_seen = None
+
+
+def parse_action(action, encoder):
+    """
+    Validates a trigger action.
+
+    Returns
+    -------
+    action, data : str, bytes or None
+        The normalised action, and the encoded bytes for a send action.
+
+    Raises
+    ------
+    ValueError
+        If the action is unknown or its text can't be encoded.
+    """
+    kind, sep, argument = action.partition(':')
+    if kind == 'beep' and not sep:
+        return action, None
+    if kind == 'log':
+        return 'log:' + (argument or 'triggers.log'), None
+    if kind == 'send' and sep:
+        return action, encoder.encode(argument)
+    raise ValueError("Invalid action '%s', expected beep, log[:FILE] or "
+                     "send:TEXT." % action)
+
+
+class TriggerSet(object):
+    """
+    The triggers of a session, evaluated by the reader thread against every
+    received chunk through `scan`. Literal patterns share one `AhoCorasick`
+    automaton and regular expressions one `RegexMatcher`, so the cost of
+    data that matches nothing barely depends on the number of triggers.
+
+    The matchers are rebuilt whenever triggers are added or removed, and
+    swapped in with a single assignment, so the reader never needs a lock.
+    Send actions are queued directly from the reader thread, log actions go
+    through a `LogWriter` per file and bells are counted in `bells` for the
+    UI to ring.
+    """
+    def __init__(self, writer):
+        """
+        Parameters
+        ----------
+        writer : SerialWriter
+            The writer send actions are queued on.
+        """
+        self.writer = writer
+        self.triggers = []
+        self.bells = 0
+        self.dropped_sends = 0
+        self.offset = time.time() - time.monotonic()
+        self._logs = {}
+        self._compiled = None
+
+    def __len__(self):
+        return len(self.triggers)
+
+    @property
+    def hits(self):
+        return sum(trigger.hits for trigger in self.triggers)
+
+    def add(self, trigger):
+        """
+        Adds a trigger.
+
+        Raises
+        ------
+        ValueError
+            If the pattern is empty or not a valid regular expression, or
+            the log file can't be opened.
+        """
+        if len(trigger.pattern) == 0:
+            raise ValueError('Empty pattern.')
+        triggers = self.triggers + [trigger]
+        try:
+            pattern = trigger.pattern.encode('latin1')
+            if not trigger.literal:
+                re.compile(pattern)
+            compiled = self._build(triggers)
+        except (re.error, UnicodeEncodeError) as e:
+            raise ValueError('Invalid pattern: %s' % e)
+        if trigger.action.startswith('log:'):
+            filename = trigger.action[len('log:'):]
+            if filename not in self._logs:
+                try:
+                    self._logs[filename] = LogWriter(filename)
+                except (IOError, OSError):
+                    raise ValueError('Invalid filename specified.')
+        self.triggers = triggers
+        self._compiled = compiled
+
+    def remove(self, n):
+        """
+        Removes the trigger with index `n`.
+        """
+        self.triggers = self.triggers[:n] + self.triggers[n + 1:]
+        self._compile()
+        self._close_unused_logs()
+
+    def clear(self):
+        self.triggers = []
+        self._compile()
+        self._close_unused_logs()
+
+    def close(self):
+        """
+        Stops matching and closes all log files.
+        """
+        self.clear()
+
+    def scan(self, data, timestamp):
+        """
+        Matches a received chunk and runs the actions of the triggers hit.
+        Called from the reader thread.
+        """
+        compiled = self._compiled
+        if compiled is None:
+            return
+        literal, literals, regex, regexes = compiled
+        hits = []
+        if literal is not None:
+            hits.extend((literals[n], None) for n in literal.feed(data))
+        if regex is not None:
+            hits.extend((regexes[n], text) for n, text in regex.feed(data))
+        for trigger, text in hits:
+            self._hit(trigger, text, timestamp)
+
+    def _hit(self, trigger, text, timestamp):
+        trigger.hits += 1
+        if trigger.first_seen is None:
+            trigger.first_seen = timestamp
+        trigger.last_seen = timestamp
+        if trigger.action == 'beep':
+            self.bells += 1
+        elif trigger.action.startswith('send:'):
+            try:
+                self.writer.write(trigger.data, block=False)
+            except queue.Full:
+                self.dropped_sends += 1
+        else:
+            log = self._logs.get(trigger.action[len('log:'):])
+            if log is not None:
+                if text is None:
+                    text = trigger.pattern.encode('latin1')
+                log.write(b'%s %s\n' % (self.time_str(timestamp).encode(
+                    'ascii'), text))
+
+    def time_str(self, timestamp):
+        """
+        Formats a monotonic timestamp as local wall clock time.
+        """
+        wall = timestamp + self.offset
+        return '%s.%03d' % (time.strftime('%Y-%m-%d %H:%M:%S',
+                                          time.localtime(wall)),
+                            int(wall % 1 * 1000))
+
+    def report_str(self):
+        """
+        Multi line table of all triggers for the %trigger list overlay.
+        """
+        lines = ['Triggers', '']
+        if len(self.triggers) == 0:
+            lines.append('None, add one with %trigger add PATTERN.')
+        for n, trigger in enumerate(self.triggers):
+            lines.append('%d  %s  [%s%s]' % (
+                n + 1, trigger.pattern, trigger.action,
+                '' if trigger.literal else ', regex'))
+            if trigger.hits == 0:
+                lines.append('   no hits')
+            else:
+                lines.append('   %d hits, first %s, last %s' % (
+                    trigger.hits, self.time_str(trigger.first_seen),
+                    self.time_str(trigger.last_seen)))
+        if self.dropped_sends > 0:
+            lines.extend(['', '%d sends dropped, transmit queue full.' %
+                          self.dropped_sends])
+        return '\n'.join(lines)
+
+    def _compile(self):
+        self._compiled = self._build(self.triggers)
+
+    def _build(self, triggers):
+        """
+        Returns the matchers for `triggers`, None if there are none.
+
+        Raises
+        ------
+        re.error
+            If a pattern is invalid.
+        """
+        if len(triggers) == 0:
+            return None
+        literals = [t for t in triggers if t.literal]
+        regexes = [t for t in triggers if not t.literal]
+        literal = None
+        if len(literals) > 0:
+            literal = AhoCorasick([t.pattern.encode('latin1')
+                                   for t in literals])
+        regex = None
+        if len(regexes) > 0:
+            regex = RegexMatcher([t.pattern.encode('latin1')
+                                  for t in regexes])
+        return (literal, literals, regex, regexes)
+
+    def _close_unused_logs(self):
+        used = set(t.action[len('log:'):] for t in self.triggers
+                   if t.action.startswith('log:'))
+        for filename in list(self._logs):
+            if filename not in used:
+                self._logs.pop(filename).close()
@@ -0,0 +1,1055 @@
+# -*- coding: utf-8 -*-
+
+"""
+The interactive urwid interface.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import threading
+import collections
+import queue
+import time
+import argparse
+
+import serial
+import urwid
+
+import sermon.util as util
+from sermon.magics import magic
+from sermon.resources import help_status_str
+from sermon.scrollback import Scrollback
+from sermon.writer import SerialWriter
+from sermon.supervisor import Reconnector
+from sermon.stats import Stats
+from sermon.hexdump import HexDumper
+from sermon.framing import make_decoder, make_encoder, format_frame
+from sermon.crc import crcs
+from sermon.capture import RX
+from sermon.timestamps import LineTimestamper
+from sermon.search import LineIndex
+from sermon.reader import DeviceReader
+from sermon.expect import Expecter, latency_str
+from sermon.triggers import TriggerSet
+from sermon.telemetry import Telemetry
+
+
+class ConsoleEdit(urwid.Edit):
+    def __init__(self, callback, *args, **kwargs):
+        super(ConsoleEdit, self).__init__(*args, **kwargs)
+        self.callback = callback
+        self.history = []
+        self.history_pos = 0
+
+    def keypress(self, size, key):
+        if key == 'enter':
+            self.callback(self.edit_text)
+            self.history.append(self.edit_text)
+            self.history_pos = 0
+            self.set_edit_text('')
+            return False
+        elif key == 'up':
+            # Cycle backwards in history, unless already as far back as we can
+            # go.
+            if self.history_pos == len(self.history):
+                # Already as far as we can go in history.
+                util.beep()
+                return
+            self.history_pos = util.limit(self.history_pos + 1,
+                                          1, len(self.history))
+            self.set_edit_text(
+                self.history[-self.history_pos])
+            self.set_edit_pos(len(self.edit_text))
+        elif key == 'down':
+            # Cycle forwards in history.
+            if self.history_pos == 1:
+                self.history_pos = 0
+                return False
+            elif self.history_pos == 0:
+                util.beep()
+                return
+
+            self.history_pos = util.limit(self.history_pos - 1,
+                                          1, len(self.history))
+            self.set_edit_text(
+                self.history[-self.history_pos])
+            self.set_edit_pos(len(self.edit_text))
+            return
+        else:
+            return super(ConsoleEdit, self).keypress(size, key)
+
+
+class ScrollingTextOverlay(urwid.Overlay):
+    def __init__(self, content, bottom_widget):
+        """
+        Parameters
+        ----------
+        content : str
+            The contents to display in the overlay widget.
+        bottom_widget : urwid.Widget
+            The original widget that the overlay appears over.
+        """
+        listbox = urwid.ListBox([urwid.Text(content)])
+        frame = urwid.Frame(listbox,
+                            header=urwid.AttrMap(
+                                urwid.Text(help_status_str), 'statusbar'))
+
+        super(ScrollingTextOverlay, self).__init__(
+            frame, bottom_widget,
+            align='center', width=('relative', 100),
+            valign='top', height=('relative', 100),
+            left=0, right=0,
+            top=0, bottom=0)
+
+    def keypress(self, size, key):
+        if key == 'j':
+            key = 'down'
+        elif key == 'k':
+            key = 'up'
+        elif key == 'ctrl d':
+            key = 'page down'
+        elif key == 'ctrl u':
+            key = 'page up'
+        return super(ScrollingTextOverlay, self).keypress(size, key)
+
+
+class TimedMainLoop(urwid.MainLoop):
+    """
+    A MainLoop that records how long each screen redraw takes in `stats`,
+    which a `MultiSermon` points at the statistics of the device shown.
+    """
+    def __init__(self, stats, *args, **kwargs):
+        self.stats = stats
+        super(TimedMainLoop, self).__init__(*args, **kwargs)
+
+    def draw_screen(self):
+        start = time.monotonic()
+        super(TimedMainLoop, self).draw_screen()
+        if self.stats is not None:
+            self.stats.record_redraw(time.monotonic() - start)
+
+
+class ScrollbackWalker(urwid.ListWalker):
+    """
+    A list walker presenting each line of a `Scrollback` as its own widget.
+    Widgets are only created for the lines the ListBox asks for, which is
+    roughly the lines on screen, so redraw cost depends on the terminal
+    height rather than the amount of data received. Complete lines never
+    change, so their widgets (and the wrapped layout urwid caches on each
+    Text) are kept in a small LRU cache.
+    """
+    def __init__(self, scrollback, cache_size=512):
+        """
+        Parameters
+        ----------
+        scrollback : Scrollback
+            The line store to display.
+        cache_size : int
+            Number of line widgets to keep cached.
+        """
+        self.scrollback = scrollback
+        self.cache_size = cache_size
+        self.highlight = None
+        self._cache = collections.OrderedDict()
+        self._partial = urwid.Text('')
+        self.focus = scrollback.end
+
+    def __getitem__(self, position):
+        if position == self.scrollback.end:
+            if self._partial.text != self.scrollback.partial:
+                self._partial.set_text(self.markup(self.scrollback.partial))
+            return self._partial
+        if position < self.scrollback.start or position > self.scrollback.end:
+            raise IndexError(position)
+        try:
+            widget = self._cache.pop(position)
+        except KeyError:
+            widget = urwid.Text(self.markup(self.scrollback.line(position)))
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+        self._cache[position] = widget
+        return widget
+
+    def markup(self, line):
+        """
+        Returns the text markup for a line, with matches of `highlight`
+        shown in the 'match' attribute.
+        """
+        if self.highlight is None:
+            return line
+        markup = []
+        pos = 0
+        for match in self.highlight.finditer(line):
+            if match.end() > match.start():
+                markup.append(line[pos:match.start()])
+                markup.append(('match', match.group()))
+                pos = match.end()
+        if len(markup) == 0:
+            return line
+        markup.append(line[pos:])
+        return [item for item in markup if len(item) > 0]
+
+    def set_highlight(self, regex):
+        """
+        Highlights matches of a compiled regular expression, or nothing if
+        `regex` is None.
+        """
+        self.highlight = regex
+        self._cache.clear()
+        self._partial.set_text(self.markup(self.scrollback.partial))
+        self._modified()
+
+    def get_focus(self):
+        return self[self.focus], self.focus
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        if position >= self.scrollback.end:
+            return None, None
+        return self[position + 1], position + 1
+
+    def get_prev(self, position):
+        if position <= self.scrollback.start:
+            return None, None
+        return self[position - 1], position - 1
+
+    @property
+    def following(self):
+        """
+        True if the focus is on the line currently being received.
+        """
+        return self.focus >= self.scrollback.end
+
+    def update(self, follow):
+        """
+        Must be called after the scrollback has changed.
+
+        Parameters
+        ----------
+        follow : bool
+            Move the focus to the newest line.
+        """
+        if follow:
+            self.focus = self.scrollback.end
+        else:
+            self.focus = util.limit(self.focus, self.scrollback.start,
+                                    self.scrollback.end)
+        # Positions are never reused, so widgets of dropped lines can simply
+        # age out of the cache.
+        self._modified()
+
+    def reset(self):
+        """
+        Drops all cached widgets, e.g. after the scrollback was cleared.
+        """
+        self._cache.clear()
+        self.update(True)
+
+
+class FilteredWalker(ScrollbackWalker):
+    """
+    A list walker presenting only the scrollback lines in a `LineIndex`.
+    Positions are absolute line indices, as for `ScrollbackWalker`, so they
+    stay valid while matches are added and old lines dropped. The line
+    being received is not shown.
+    """
+    def __init__(self, scrollback, index, cache_size=512):
+        """
+        Parameters
+        ----------
+        scrollback : Scrollback
+            The line store to display.
+        index : LineIndex
+            The lines to show.
+        cache_size : int
+            Number of line widgets to keep cached.
+        """
+        super(FilteredWalker, self).__init__(scrollback, cache_size)
+        self.index = index
+        self.focus = None
+        self._following = True
+
+    def get_focus(self):
+        if self.focus is None:
+            return None, None
+        return self[self.focus], self.focus
+
+    def set_focus(self, position):
+        self.focus = position
+        self._following = self.index.after(position) is None
+        self._modified()
+
+    def get_next(self, position):
+        position = self.index.after(position)
+        if position is None:
+            return None, None
+        return self[position], position
+
+    def get_prev(self, position):
+        position = self.index.before(position)
+        if position is None:
+            return None, None
+        return self[position], position
+
+    @property
+    def following(self):
+        return self._following
+
+    def update(self, follow):
+        if follow or self.focus is None:
+            self.focus = self.index.last()
+            self._following = True
+        elif self.focus < self.scrollback.start:
+            self.focus = self.index.after(self.scrollback.start - 1)
+        self._modified()
+
+
+palette = [
+    ('error', 'light red', 'black'),
+    ('ok', 'dark green', 'black'),
+    ('statusbar', '', 'black'),
+    ('match', 'black', 'yellow'),
+    ('tab', '', 'black'),
+    ('tab active', 'black', 'light gray'),
+    ('tab activity', 'yellow', 'black'),
+    ('telemetry', 'light cyan', 'black'),
+]
+
+
+class TelemetryView(urwid.Widget):
+    """
+    Readout below the received data with a row for every telemetry field,
+    redrawn only when `update` finds new rows.
+    """
+    _sizing = frozenset(['flow'])
+
+    def __init__(self, telemetry):
+        super(TelemetryView, self).__init__()
+        self.telemetry = telemetry
+        self.drawn = None
+        self.fields = 1
+
+    def update(self):
+        if self.telemetry.rows != self.drawn:
+            self.drawn = self.telemetry.rows
+            # Fix the number of rows until the next update, the reader may
+            # add fields at any time.
+            self.fields = max(1, len(self.telemetry.names))
+            self._invalidate()
+
+    def rows(self, size, focus=False):
+        return self.fields
+
+    def render(self, size, focus=False):
+        lines = self.telemetry.readout_lines(size[0])[:self.fields]
+        lines += [''] * (self.fields - len(lines))
+        text = urwid.Text(('telemetry', '\n'.join(lines)), wrap='clip')
+        return text.render(size)
+
+
+class Sermon(object):
+    """
+    The main serial monitor class. Starts a read thread that polls the serial
+    device and prints results to top window. Sends commands to serial device
+    after they have been executed in the curses textpad.
+
+    When monitoring several devices, a `MultiSermon` creates one instance per
+    device sharing its urwid loop and reads all of them from one thread.
+    """
+    def __init__(self, device, args, loop=None, group=None):
+        # Receive display widgets
+        self.scrollback = Scrollback(args.scrollback_lines,
+                                     args.scrollback_bytes)
+        self.line_walker = ScrollbackWalker(self.scrollback)
+        self.receive_walker = self.line_walker
+        self.hexdumper = HexDumper()
+        self.hex_mode = args.hex
+        self.timestamper = None
+        if args.timestamps is not None:
+            self.timestamper = LineTimestamper(args.timestamps)
+        self.decoder = None
+        if args.rx_protocol is not None:
+            self.decoder = make_decoder(args.rx_protocol,
+                                        crcs.get(args.rx_crc),
+                                        args.length_bytes, args.length_order)
+        self.body = urwid.ListBox(self.receive_walker)
+        self.telemetry = None
+        main = self.body
+        if args.telemetry is not None:
+            self.telemetry = Telemetry(args.telemetry,
+                                       args.telemetry_samples)
+            self.telemetry_view = TelemetryView(self.telemetry)
+            main = urwid.Pile([self.body, ('pack', self.telemetry_view)])
+
+        # Draw main frame with status header and footer for commands.
+        self.conection_msg = urwid.Text('', 'left')
+        self.activity_msg = urwid.Text('', 'center')
+        self.status_msg = urwid.Text('', 'right')
+        self.header = urwid.Columns([self.conection_msg,
+                                     ('pack', self.activity_msg),
+                                     self.status_msg],
+                                    dividechars=2)
+        self.frame = urwid.Frame(
+            main,
+            header=urwid.AttrMap(self.header, 'statusbar'),
+            footer=ConsoleEdit(self.on_edit_done, ': '),
+            focus_part='footer')
+        self.stats = Stats()
+        self.group = group
+        if loop is None:
+            self.loop = TimedMainLoop(
+                self.stats, self.frame, palette,
+                unhandled_input=self.unhandled_key_handler)
+        else:
+            self.loop = loop
+
+        # The reader thread buffers received chunks and only writes to the
+        # pipe to wake the UI, which then flushes at most `fps` times a second.
+        self.rx_buffer = util.ChunkBuffer()
+        self.fd = self.loop.watch_pipe(self.on_wake)
+        self.frame_interval = 1.0 / args.fps
+        self.activity_interval = 0.25
+        self.last_flush = 0
+        self.flush_alarm = None
+
+        # Search and filter indices notify the UI through their own pipe.
+        self.search_fd = self.loop.watch_pipe(self.on_search_results)
+        self.finder = None
+        self.find_from = None
+        self.filter = None
+
+        self.stop_event = threading.Event()
+        self.read_chunk = args.read_chunk
+        self.framer = None
+        if args.tx_protocol is not None:
+            self.framer = make_encoder(args.tx_protocol,
+                                       crcs.get(args.tx_crc),
+                                       args.length_bytes, args.length_order)
+        self.encoder = util.CommandEncoder(util.unescape(args.frame),
+                                           util.unescape(args.append),
+                                           framer=self.framer)
+        self.device = device
+        self.serial = util.open_serial(device, args)
+        self.connection_state = ('ok', self.serial.name)
+        self.conection_msg.set_text(self.connection_state)
+        self.writer = SerialWriter(self.serial)
+        self.reconnector = Reconnector(device, args, self.stop_event)
+        self.transfer = None
+        self.expecter = Expecter()
+        self.script = None
+        self.triggers = TriggerSet(self.writer)
+        self.bells = 0
+        self.bridge = None
+        if args.serve is not None:
+            self.bridge = util.serve(
+                args.serve, lambda data: self.writer.write(data, block=False))
+
+        self.worker = threading.Thread(target=self.serial_read_worker)
+        self.worker.daemon = True
+
+        self.logging = False
+        self.logfile = None
+        self.logger = None
+        self.capture = None
+        magic.app = self
+
+        self.stats.gauges.update({
+            'rx_backlog': lambda: len(self.rx_buffer),
+            'tx_bytes': lambda: self.writer.bytes_written,
+            'tx_writes': lambda: self.writer.writes,
+            'tx_queue': lambda: self.writer.depth,
+            'tx_pending': lambda: self.writer.pending_bytes,
+            'log_bytes': lambda: (self.logger.bytes_written
+                                  if self.logger is not None else 0),
+            'log_queue': lambda: (self.logger.pending
+                                  if self.logger is not None else 0),
+            'expect_round_trips': lambda: latency_str(
+                self.expecter.latencies),
+            'trigger_hits': lambda: self.triggers.hits})
+        if self.telemetry is not None:
+            self.stats.gauges.update({
+                'telemetry_rows': lambda: self.telemetry.rows,
+                'telemetry_skipped': lambda: self.telemetry.skipped})
+        if self.decoder is not None:
+            self.stats.gauges.update({
+                'rx_frames': lambda: self.decoder.frames,
+                'rx_decode_errors': lambda: self.decoder.decode_errors,
+                'rx_crc_errors': lambda: self.decoder.crc_errors})
+        if self.bridge is not None:
+            self.stats.gauges.update({
+                'bridge_clients': lambda: len(self.bridge.clients),
+                'bridge_dropped': lambda: self.bridge.dropped,
+                'bridge_bytes_sent': lambda: self.bridge.bytes_sent,
+                'bridge_bytes_received': lambda: self.bridge.bytes_received})
+        self.stats_snapshot = self.stats.rates()
+        if args.stats_log is not None:
+            self.stats.start_dump(args.stats_log, args.stats_interval,
+                                  self.stop_event)
+
+    def update_status(self, status, text):
+        self.status_msg.set_text((status, text))
+
+    def unhandled_key_handler(self, key):
+        if key in ('q', 'esc'):
+            self.loop.widget = self.main_widget()
+
+    def main_widget(self):
+        """
+        The widget shown when no overlay is open.
+        """
+        if self.group is not None:
+            return self.group.widget
+        return self.frame
+
+    def on_edit_done(self, edit_text):
+        """
+        Callback called when editing is completed (after enter is pressed)
+        """
+        if len(edit_text) < 1:
+            self.update_status('ok', '')
+            return
+        if edit_text[0] == '%':
+            # Handle magic command.
+            try:
+                result = magic.execute(edit_text[1:])
+                if result['status'] is not None:
+                    self.update_status('ok', result['status'])
+                if result['bytes_to_send'] is not None:
+                    self.send(result['bytes_to_send'])
+            except (util.ArgumentParseError, AttributeError, ValueError) as e:
+                self.update_status('error', str(e))
+            return
+        if self.group is not None and self.group.broadcast:
+            self.group.send_command(edit_text)
+            return
+        if self.logging:
+            self.update_status('ok', 'Logging to %s' % self.logfile)
+        try:
+            self.send(self.encoder.encode(edit_text))
+        except ValueError as e:
+            self.update_status('error', str(e))
+
+    def send(self, data):
+        """
+        Queues data to be written to the serial device without blocking.
+        """
+        try:
+            self.writer.write(data, block=False)
+            self.expecter.mark_sent()
+        except queue.Full:
+            self.update_status('error', 'Transmit queue full.')
+        self.update_activity()
+
+    def start_transfer(self, transfer):
+        """
+        Starts streaming a file, progress is shown in the status bar.
+
+        Parameters
+        ----------
+        transfer : FileTransfer
+            The transfer to start.
+        """
+        self.transfer = transfer
+        transfer.start()
+
+    def start_script(self, script):
+        """
+        Starts running expect steps, progress is shown in the status bar.
+
+        Parameters
+        ----------
+        script : ExpectScript
+            The steps to run.
+        """
+        self.script = script
+        script.start()
+
+    def update_activity(self, loop=None, user_data=None):
+        """
+        Refreshes the activity readout in the status bar. When called from
+        the urwid loop it reschedules itself.
+        """
+        self.poll_activity()
+        text = self.stats.summary_str(self.stats_snapshot)
+        if self.decoder is not None:
+            text += '  frames %d' % self.decoder.frames
+            errors = self.decoder.decode_errors + self.decoder.crc_errors
+            if errors > 0:
+                text += ' (%d decode, %d crc errors)' % (
+                    self.decoder.decode_errors, self.decoder.crc_errors)
+        if self.bridge is not None:
+            text += '  ' + self.bridge.status_str()
+        if len(self.triggers) > 0:
+            text += '  triggers %d hits' % self.triggers.hits
+        self.ring_bells()
+        if self.transfer is not None:
+            text += '  ' + self.transfer.progress_str()
+        elif self.script is not None:
+            text += '  ' + self.script.progress_str()
+        elif self.writer.busy:
+            text += '  tx %d queued, %d bytes' % (self.writer.depth,
+                                                   self.writer.pending_bytes)
+        connection = (('ok' if self.reconnector.connected else 'error'),
+                      self.reconnector.status_str())
+        if connection != self.connection_state:
+            self.connection_state = connection
+            self.conection_msg.set_text(connection)
+        if text != self.activity_msg.text:
+            self.activity_msg.set_text(text)
+        if loop is not None:
+            loop.set_alarm_in(self.activity_interval, self.update_activity)
+
+    def poll_activity(self):
+        """
+        Reaps a finished transfer or script, reports writer errors and
+        updates the statistics and telemetry, also while a `MultiSermon`
+        shows another device.
+        """
+        if self.transfer is not None and self.transfer.done:
+            status = 'ok' if self.transfer.error is None else 'error'
+            self.update_status(status, self.transfer.status_str())
+            self.transfer = None
+        if self.script is not None and self.script.done:
+            status = 'ok' if self.script.failed is None else 'error'
+            self.update_status(status, self.script.status_str())
+            self.script = None
+        if self.writer.error is not None:
+            self.writer.error = None
+            self.update_status('error', 'Error writing to device.')
+        if time.monotonic() - self.stats.started - \
+                self.stats_snapshot['time'] >= 1:
+            self.stats_snapshot = self.stats.rates(self.stats_snapshot)
+        if self.telemetry is not None:
+            self.telemetry_view.update()
+
+    def ring_bells(self):
+        """
+        Rings the terminal bell if a beep trigger was hit since the last
+        call.
+        """
+        if self.triggers.bells != self.bells:
+            self.bells = self.triggers.bells
+            self.loop.screen.write('\a')
+            self.loop.screen.flush()
+
+    def overlay(self, content):
+        """
+        Shows the given content in an overlay window above the main frame.
+
+        Parameters
+        ----------
+        content : str
+            The text content to display over the main frame.
+        """
+        self.loop.widget = ScrollingTextOverlay(content, self.main_widget())
+
+    def clear(self):
+        """
+        Clears all received data from the scrollback and display.
+        """
+        self.scrollback.clear()
+        self.line_walker.reset()
+        if self.receive_walker is not self.line_walker:
+            self.receive_walker.reset()
+
+    def on_wake(self, data):
+        """
+        Called when the read thread signals new data. Flushes immediately if
+        the last flush was long enough ago, otherwise schedules a flush for
+        the start of the next frame.
+        """
+        if self.flush_alarm is not None:
+            return
+        delay = self.last_flush + self.frame_interval - time.monotonic()
+        if delay <= 0:
+            self.flush_received()
+        else:
+            self.flush_alarm = self.loop.set_alarm_in(delay,
+                                                      self.flush_received)
+
+    def flush_received(self, loop=None, user_data=None):
+        """
+        Displays all data buffered since the last flush.
+        """
+        self.flush_alarm = None
+        self.last_flush = time.monotonic()
+        chunks, times = self.rx_buffer.take()
+        if len(chunks) > 0:
+            self.stats.record_flush(len(chunks), self.last_flush - times[0])
+            if self.timestamper is not None and not self.hex_mode:
+                self.received_data(self.timestamper.stamp_chunks(chunks,
+                                                                 times))
+            else:
+                self.received_data(b''.join(chunks))
+            if self.group is not None:
+                self.group.on_received(self)
+
+    def received_data(self, data):
+        if self.logging:
+            if self.logger.error is not None:
+                self.update_status('error', 'Error writing to logfile.')
+            self.logger.write(data)
+        follow = self.receive_walker.following
+        if self.decoder is not None:
+            self.scrollback.append_lines(
+                [format_frame(frame, error, self.hex_mode)
+                 for frame, error in self.decoder.feed(data)])
+        elif self.hex_mode:
+            lines = self.hexdumper.feed(data)
+            self.scrollback.append_lines(lines, self.hexdumper.partial())
+        else:
+            # Drop carriage returns, otherwise urwid shows \r\n line endings
+            # as stray characters.
+            data = data.replace(b'\r', b'')
+            self.scrollback.append(data.decode('latin1'))
+        if self.finder is not None:
+            self.finder.update()
+        if self.filter is not None:
+            self.filter.update()
+        self.receive_walker.update(follow)
+
+    def find(self, pattern=None):
+        """
+        Moves the focus to the closest line above it matching a regular
+        expression and highlights all matches. Without a pattern, continues
+        with the previous one. The scrollback is scanned in the background,
+        the focus moves once a match has been found.
+        """
+        if pattern is None:
+            if self.finder is None:
+                raise ValueError('No previous search.')
+        elif self.finder is None or self.finder.pattern != pattern:
+            finder = LineIndex(self.scrollback, pattern, self.notify_search)
+            self.stop_find()
+            self.finder = finder
+            self.line_walker.set_highlight(finder.regex)
+        if self.filter is not None:
+            # Matches are shown in the complete scrollback.
+            self.set_filter(None)
+        self.find_from = self.line_walker.focus
+        self.finder.waiting = True
+        self.finder.update()
+        self.resolve_find()
+
+    def resolve_find(self):
+        """
+        Moves the focus to the match a pending `find` is waiting for, once
+        it has been found or the search has failed.
+        """
+        if self.find_from is None:
+            return
+        match = self.finder.before(self.find_from)
+        if match is not None:
+            self.find_from = None
+            self.finder.waiting = False
+            self.line_walker.set_focus(match)
+            self.update_status('ok', 'Match %d lines up, %d matches.' %
+                               (self.scrollback.end - match,
+                                len(self.finder)))
+        elif self.finder.scanned >= self.find_from:
+            self.find_from = None
+            self.finder.waiting = False
+            self.update_status('error', 'Pattern not found.')
+        else:
+            self.update_status('ok', 'Searching...')
+
+    def stop_find(self):
+        """
+        Ends the current search and removes its highlighting.
+        """
+        if self.finder is not None:
+            self.finder.close()
+            self.finder = None
+            self.find_from = None
+            self.line_walker.set_highlight(None)
+
+    def set_filter(self, pattern):
+        """
+        Shows only lines matching a regular expression, or all lines if
+        `pattern` is None. Matching lines are found in the background and
+        shown as they are found.
+        """
+        if pattern is not None:
+            index = LineIndex(self.scrollback, pattern, self.notify_search)
+        if self.filter is not None:
+            self.filter.close()
+            self.filter = None
+        if pattern is None:
+            self.receive_walker = self.line_walker
+            self.line_walker.update(self.line_walker.following)
+        else:
+            self.filter = index
+            self.receive_walker = FilteredWalker(self.scrollback, index)
+        self.body.body = self.receive_walker
+
+    def notify_search(self):
+        """
+        Called from search threads when results change.
+        """
+        os.write(self.search_fd, b'.')
+
+    def on_search_results(self, data):
+        self.resolve_find()
+        if self.filter is not None:
+            self.receive_walker.update(self.receive_walker.following)
+
+    def set_hex_mode(self, enabled):
+        """
+        Switches between displaying received data as text and as a hex dump.
+        Data already displayed is left as it is.
+        """
+        follow = self.receive_walker.following
+        self.scrollback.break_line()
+        self.hexdumper.reset()
+        if self.timestamper is not None:
+            self.timestamper.reset()
+        self.hex_mode = enabled
+        self.receive_walker.update(follow)
+
+    def stop_logging(self):
+        """
+        Stops logging and closes the logfile, writing any buffered data.
+        """
+        self.logging = False
+        if self.logger is not None:
+            self.logger.close()
+            self.logger = None
+
+    def start_capture(self, capture):
+        """
+        Starts recording received and sent data, replacing any capture in
+        progress.
+
+        Parameters
+        ----------
+        capture : CaptureWriter
+            The capture to record to.
+        """
+        self.stop_capture()
+        self.capture = capture
+        self.writer.capture = capture
+
+    def stop_capture(self):
+        """
+        Stops recording and closes the capture file.
+        """
+        capture = self.capture
+        if capture is not None:
+            self.capture = None
+            self.writer.capture = None
+            capture.close()
+
+    def serial_read_worker(self):
+        """
+        Reads serial device and prints results to upper curses window.
+        """
+        while not self.stop_event.is_set():
+            try:
+                data = util.read_available(self.serial, self.read_chunk)
+            except (serial.SerialException, OSError):
+                if self.stop_event.is_set():
+                    return
+                ser = self.reconnector.reconnect(self.serial)
+                if ser is not None:
+                    self.serial = ser
+                    self.writer.serial = ser
+                continue
+            if len(data) > 0:
+                self.received_chunk(data)
+
+    def received_chunk(self, data):
+        """
+        Handles a chunk just read from the device, called from the thread
+        reading it.
+        """
+        now = time.monotonic()
+        capture = self.capture
+        if capture is not None:
+            capture.record(RX, data, now)
+        self.expecter.feed(data, now)
+        self.triggers.scan(data, now)
+        if self.telemetry is not None:
+            self.telemetry.feed(data, now)
+        if self.bridge is not None:
+            self.bridge.broadcast(data)
+        waiting = len(data)
+        if waiting == self.read_chunk:
+            # More may be waiting, sample the OS buffer to track overruns.
+            waiting += self.serial.in_waiting
+        self.stats.record_read(len(data), waiting)
+        if self.rx_buffer.put(data, now):
+            os.write(self.fd, b'.')
+
+    def start(self):
+        self.worker.start()
+        self.loop.set_alarm_in(self.activity_interval, self.update_activity)
+        self.loop.run()
+
+    def stop(self):
+        self.stop_event.set()
+        util.cancel_read(self.serial)
+        if self.worker.ident is not None:
+            self.worker.join()
+        if self.transfer is not None:
+            self.transfer.cancel()
+        if self.script is not None:
+            self.script.cancel()
+        self.writer.close()
+        if self.bridge is not None:
+            self.bridge.close()
+        self.serial.close()
+        self.flush_received()
+        self.stop_logging()
+        self.stop_capture()
+        self.triggers.close()
+        self.stop_find()
+        self.set_filter(None)
+
+    def exit(self):
+        if self.group is not None:
+            self.group.stop()
+        else:
+            self.stop()
+        raise urwid.ExitMainLoop()
+
+
+class MultiSermon(object):
+    """
+    Monitors several devices in one process. Every device gets its own
+    `Sermon`, with its own scrollback, prompt, logging and statistics, all
+    sharing one urwid loop and one `DeviceReader` thread. One device is shown
+    at a time, chosen from the tab bar with tab and shift-tab or %tab. Input
+    at the prompt goes to the device shown, or to all of them after
+    %broadcast.
+    """
+    def __init__(self, devices, args):
+        """
+        Parameters
+        ----------
+        devices : list of str
+            Device names, paths or URLs.
+        args : argparse.Namespace
+            Parsed command line arguments, used for every device.
+        """
+        self.tabs = urwid.Text('', wrap='clip')
+        self.body = urwid.WidgetPlaceholder(urwid.SolidFill())
+        self.widget = urwid.Frame(self.body, header=self.tabs)
+        self.loop = TimedMainLoop(None, self.widget, palette,
+                                  unhandled_input=self.unhandled_key_handler)
+        self.activity_interval = 0.25
+        self.broadcast = False
+        self.unseen = set()
+        self.reader = DeviceReader()
+        self.sessions = []
+        try:
+            for n, device in enumerate(devices):
+                device_args = argparse.Namespace(**vars(args))
+                if args.stats_log is not None:
+                    device_args.stats_log = '%s.%d' % (args.stats_log, n + 1)
+                self.sessions.append(Sermon(device, device_args, self.loop,
+                                            self))
+        except (serial.serialutil.SerialException, ValueError):
+            self.stop()
+            raise
+        self.active = None
+        self.select(0)
+
+    def select(self, n):
+        """
+        Shows the device with index `n` and routes the prompt to it.
+        """
+        self.active = self.sessions[n % len(self.sessions)]
+        self.body.original_widget = self.active.frame
+        # Redraws are counted for the device they show.
+        self.loop.stats = self.active.stats
+        self.loop.widget = self.widget
+        magic.app = self.active
+        self.unseen.discard(self.active)
+        self.update_tabs()
+        self.active.update_activity()
+
+    def update_tabs(self):
+        markup = []
+        for n, session in enumerate(self.sessions):
+            if session is self.active:
+                attr = 'tab active'
+            elif session in self.unseen:
+                attr = 'tab activity'
+            else:
+                attr = 'tab'
+            name = session.device
+            if name.startswith('/dev/'):
+                name = name[len('/dev/'):]
+            markup.append((attr, ' %d %s ' % (n + 1, name)))
+        if self.broadcast:
+            markup.append(('error', ' broadcast'))
+        self.tabs.set_text(markup)
+
+    def on_received(self, session):
+        """
+        Marks the tab of a device which received data while not shown.
+        """
+        if session is not self.active and session not in self.unseen:
+            self.unseen.add(session)
+            self.update_tabs()
+
+    def set_broadcast(self, enabled):
+        self.broadcast = enabled
+        self.update_tabs()
+
+    def send_command(self, command):
+        """
+        Encodes a command for every device and sends it.
+        """
+        try:
+            data = [session.encoder.encode(command)
+                    for session in self.sessions]
+        except ValueError as e:
+            self.active.update_status('error', str(e))
+            return
+        for session, encoded in zip(self.sessions, data):
+            session.send(encoded)
+        self.active.update_status('ok', 'Sent to %d devices.' %
+                                  len(self.sessions))
+
+    def unhandled_key_handler(self, key):
+        if key == 'tab':
+            self.select(self.sessions.index(self.active) + 1)
+        elif key == 'shift tab':
+            self.select(self.sessions.index(self.active) - 1)
+        else:
+            self.active.unhandled_key_handler(key)
+
+    def update_activity(self, loop=None, user_data=None):
+        """
+        Refreshes the status bar of the device shown. Devices not shown
+        are polled so their transfers, scripts and errors are handled, their
+        status bars are refreshed when selected.
+        """
+        for session in self.sessions:
+            if session is not self.active:
+                session.poll_activity()
+            session.ring_bells()
+        self.active.update_activity()
+        loop.set_alarm_in(self.activity_interval, self.update_activity)
+
+    def start(self):
+        for session in self.sessions:
+            self.reader.add(session)
+        self.reader.start()
+        self.loop.set_alarm_in(self.activity_interval, self.update_activity)
+        self.loop.run()
+
+    def stop(self):
+        for session in self.sessions:
+            session.stop_event.set()
+        self.reader.stop()
+        for session in self.sessions:
+            session.stop()
@@ -6,9 +6,15 @@ from __future__ import absolute_import
 from __future__ import division
 
 import argparse
+import collections
+import datetime
 import sys
 import glob
+import re
+import threading
+import time
 
+import serial
 from serial.tools import list_ports
 
 
@@ -21,6 +27,63 @@ class ThrowingArgumentParser(argparse.ArgumentParser):
         raise ArgumentParseError(message)
 
 
+class ChunkBuffer(object):
+    """
+    A thread safe buffer of byte chunks handed from a producer thread to the
+    UI thread. The producer only needs to wake the consumer when the buffer
+    goes from empty to non-empty, so a burst of chunks costs a single wakeup.
+    Every chunk keeps the monotonic time it was read.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._times = []
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def put(self, data, timestamp=None):
+        """
+        Adds a chunk to the buffer.
+
+        Parameters
+        ----------
+        data : bytes
+            The chunk.
+        timestamp : float or None
+            `time.monotonic()` when the chunk was read, defaults to now.
+
+        Returns
+        -------
+        wake : bool
+            True if the buffer was empty and the consumer should be woken.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            self._chunks.append(data)
+            self._times.append(timestamp)
+            return len(self._chunks) == 1
+
+    def take(self):
+        """
+        Removes and returns all buffered chunks, in the order they were put.
+
+        Returns
+        -------
+        chunks : list of bytes
+            The buffered chunks.
+        times : list of float
+            Monotonic time each of them was read.
+        """
+        with self._lock:
+            chunks = self._chunks
+            times = self._times
+            self._chunks = []
+            self._times = []
+        return chunks, times
+
+
 def beep():
     sys.stdout.write('\a')
 
@@ -36,11 +99,293 @@ def limit(n, minimum, maximum):
     return n
 
 
+size_units = {'': 1, 'b': 1,
+              'k': 1024, 'kb': 1024,
+              'm': 1024 ** 2, 'mb': 1024 ** 2,
+              'g': 1024 ** 3, 'gb': 1024 ** 3}
+
+duration_units = {'ms': 0.001, 's': 1, 'sec': 1,
+                  'min': 60, 'h': 3600, 'd': 86400}
+
+quantity_pattern = re.compile(r'^\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*$')
+
+
+def parse_size(text):
+    """
+    Parses a byte count with an optional binary suffix, e.g. '512', '64K' or
+    '100M'.
+
+    Raises
+    ------
+    ValueError
+        If the text is not a valid size.
+    """
+    match = quantity_pattern.match(text)
+    if match is None or match.group(2).lower() not in size_units:
+        raise ValueError("Invalid size '%s'." % text)
+    return int(float(match.group(1)) * size_units[match.group(2).lower()])
+
+
+def parse_duration(text):
+    """
+    Parses a duration in seconds with an optional suffix, e.g. '0.5',
+    '5ms', '30s', '15min', '1h' or '1d'.
+
+    Raises
+    ------
+    ValueError
+        If the text is not a valid duration.
+    """
+    match = quantity_pattern.match(text)
+    unit = match.group(2).lower() if match is not None else None
+    if unit == '':
+        unit = 's'
+    if unit not in duration_units:
+        raise ValueError("Invalid duration '%s'." % text)
+    return float(match.group(1)) * duration_units[unit]
+
+
+def parse_time(text, reference=None):
+    """
+    Parses a point in time: Unix seconds, a local date and time like
+    '2024-05-01 13:45:00', or a local time of day like '13:45' on the day
+    of `reference`.
+
+    Parameters
+    ----------
+    text : str
+        The time.
+    reference : float or None
+        Unix time whose day a time of day refers to, defaults to today.
+
+    Returns
+    -------
+    seconds : float
+        Unix time.
+
+    Raises
+    ------
+    ValueError
+        If the text is not a valid time.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    try:
+        of_day = datetime.time.fromisoformat(text)
+    except ValueError:
+        raise ValueError("Invalid time '%s'." % text)
+    day = datetime.date.fromtimestamp(reference if reference is not None
+                                      else time.time())
+    return datetime.datetime.combine(day, of_day).timestamp()
+
+
+# matches list of bytes $(0x08, 0x09, ... ) or ${0x08, 0x09, ... }
+byte_list_pattern = re.compile(r'(\$\(([^\)]+?)\))|(\${([^\)]+?)})')
+
+
+def unescape(text):
+    """
+    Interprets backslash escapes like '\\n' in text given on the command
+    line.
+    """
+    return text.encode('latin1').decode('unicode_escape')
+
+
+def encode_text(text):
+    """
+    Encodes text as latin1, replacing any ${...} byte lists by the bytes they
+    list.
+
+    Raises
+    ------
+    ValueError
+        If a byte list contains something other than integers, or integers
+        outside 0 to 255.
+    """
+    data = bytearray()
+    pos = 0
+    for match in byte_list_pattern.finditer(text):
+        data += text[pos:match.start()].encode('latin1')
+        byte_list = match.group(2) or match.group(4)
+        for s in byte_list.split(','):
+            value = int(s.strip(), 0)
+            if not 0 <= value <= 255:
+                raise ValueError('Byte value out of range (0-255): %s' %
+                                 s.strip())
+            data.append(value)
+        pos = match.end()
+    data += text[pos:].encode('latin1')
+    return bytes(data)
+
+
+class CommandEncoder(object):
+    """
+    Builds the bytes sent for a command typed at the prompt. The command is
+    followed by the append text and then either encoded by a frame encoder
+    or surrounded by the frame text. Both texts are encoded once up front,
+    and the encoded form of recently used commands is kept in a small LRU
+    cache so repeated commands cost a dictionary lookup.
+    """
+    def __init__(self, frame_text='', append_text='', cache_size=256,
+                 framer=None):
+        """
+        Parameters
+        ----------
+        frame_text : str
+            Text sent before and after every command.
+        append_text : str
+            Text sent after every command, inside the frame.
+        cache_size : int
+            Number of encoded commands to remember.
+        framer : sermon.framing.FrameEncoder or None
+            Encoder stuffing and checksumming every command.
+        """
+        self.prefix = encode_text(frame_text)
+        self.append = encode_text(append_text)
+        self.framer = framer
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+    def encode(self, command):
+        """
+        Returns the complete bytes to send for `command`.
+
+        Raises
+        ------
+        ValueError
+            If the command contains an invalid byte list, or is too long
+            for the frame encoder.
+        """
+        try:
+            data = self._cache.pop(command)
+        except KeyError:
+            data = encode_text(command) + self.append
+            if self.framer is not None:
+                data = self.framer.encode(data)
+            data = self.prefix + data + self.prefix
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+        self._cache[command] = data
+        return data
+
+
+def open_serial(device, args, timeout=0.1):
+    """
+    Opens a serial device, or a pyserial URL like 'loop://', with the port
+    settings given on the command line and discards any stale input. With
+    `--replay` the capture file is opened as a `ReplayPort` instead.
+
+    Parameters
+    ----------
+    device : str
+        Device name, path or URL.
+    args : argparse.Namespace
+        Parsed command line arguments with parity and stopbits already
+        converted to their pyserial values.
+    timeout : float
+        Read timeout in seconds.
+
+    Returns
+    -------
+    ser : serial.Serial
+        The open port.
+    """
+    if args.replay is not None:
+        from sermon.capture import ReplayPort
+        try:
+            return ReplayPort(args.replay, args.replay_speed, timeout)
+        except (IOError, OSError) as e:
+            raise serial.SerialException('Unable to open %s: %s' %
+                                         (args.replay, e.strerror))
+    if device.startswith('tcp://'):
+        # A sermon --serve bridge or any other raw TCP serial server.
+        from sermon.bridge import TCPPort
+        return TCPPort('socket://' + device[len('tcp://'):], timeout=timeout)
+    ser = serial.serial_for_url(device,
+                                baudrate=args.baud,
+                                bytesize=args.bytesize,
+                                parity=args.parity,
+                                stopbits=args.stopbits,
+                                xonxoff=args.xonxoff,
+                                rtscts=args.rtscts,
+                                dsrdtr=args.dsrdtr,
+                                timeout=timeout)
+    time.sleep(0.1)
+    ser.flushInput()
+    return ser
+
+
+def serve(address, on_receive):
+    """
+    Starts sharing the device with TCP clients, see `TCPBridge`.
+
+    Raises
+    ------
+    ValueError
+        If the address can't be listened on.
+    """
+    from sermon.bridge import TCPBridge
+    try:
+        return TCPBridge(address, on_receive)
+    except OSError as e:
+        raise ValueError('Unable to serve on %s:%d: %s' %
+                         (address[0], address[1], e.strerror))
+
+
+def read_available(ser, size):
+    """
+    Reads everything currently waiting on a serial port in one call. If
+    nothing is waiting, blocks for a single byte until the port timeout
+    expires, so the call returns as soon as data starts arriving.
+
+    Parameters
+    ----------
+    ser : serial.Serial
+        An open serial port with a read timeout set.
+    size : int
+        Maximum number of bytes to return.
+
+    Returns
+    -------
+    data : bytes
+        The bytes read, empty if the timeout expired.
+    """
+    return ser.read(limit(ser.in_waiting, 1, size))
+
+
+def fileno(ser):
+    """
+    Returns the file descriptor of a port, or None for ports without one
+    such as loop:// or a `ReplayPort`.
+    """
+    try:
+        return ser.fileno()
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def cancel_read(ser):
+    """
+    Interrupts a blocking read on the port if the port supports it, otherwise
+    the read returns once its timeout expires.
+    """
+    try:
+        ser.cancel_read()
+    except (AttributeError, NotImplementedError):
+        pass
+
+
 def serial_devices():
     """
     Returns a list of the available serial devices.
     """
-    if sys.platform == 'darwin' and sys.version_info.major == 3:
+    if sys.platform == 'darwin':
         # pyserial's builtin port detection not working on mac with python 3
         return glob.glob('/dev/cu.*')
     else:
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+Background writer for outbound serial data.
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import queue
+import threading
+
+import serial
+
+from sermon.capture import TX
+
+
+class SerialWriter(object):
+    """
+    Writes data to the serial device from a dedicated thread so a slow link
+    never blocks the caller. Data waits in a bounded queue, consecutive small
+    writes are joined into a single write call and large ones are written in
+    slices of `max_write` bytes so progress can be tracked and cancelled.
+
+    Data can be queued with a cancel event, e.g. by a file transfer. Once the
+    event is set, that data is dropped, including any write of it in
+    progress, while data queued by others is still sent.
+    """
+    _close = object()
+
+    def __init__(self, ser, queue_size=256, max_write=4096):
+        """
+        Parameters
+        ----------
+        ser : serial.Serial
+            The open port to write to.
+        queue_size : int
+            Maximum number of writes waiting in the queue.
+        max_write : int
+            Maximum number of bytes passed to a single write call.
+        """
+        self.serial = ser
+        self.max_write = max_write
+        self.error = None
+        self.pending_bytes = 0
+        self.bytes_written = 0
+        self.writes = 0
+        self.capture = None
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._held = None
+        self._queue = queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data, block=True, timeout=None, cancel=None):
+        """
+        Queues data to be written.
+
+        Parameters
+        ----------
+        cancel : threading.Event or None
+            Event which drops the data if set before it has been written.
+            A blocking write without a timeout also gives up once it is set.
+
+        Raises
+        ------
+        queue.Full
+            If the queue is full and block is False or the timeout expires.
+        """
+        with self._cond:
+            self.pending_bytes += len(data)
+        try:
+            if cancel is not None and block and timeout is None:
+                while True:
+                    try:
+                        self._queue.put((data, cancel), timeout=0.1)
+                        break
+                    except queue.Full:
+                        if cancel.is_set():
+                            raise
+            else:
+                self._queue.put((data, cancel), block, timeout)
+        except queue.Full:
+            with self._cond:
+                self.pending_bytes -= len(data)
+                self._cond.notify_all()
+            if cancel is None or not cancel.is_set():
+                raise
+
+    @property
+    def depth(self):
+        """
+        Number of writes waiting in the queue.
+        """
+        return self._queue.qsize()
+
+    @property
+    def busy(self):
+        """
+        True while any data is queued or being written.
+        """
+        return self.pending_bytes > 0
+
+    def wait(self, max_pending=0, timeout=None):
+        """
+        Blocks until at most `max_pending` bytes are waiting to be written.
+
+        Returns
+        -------
+        reached : bool
+            False if the timeout expired first.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.pending_bytes <= max_pending, timeout)
+
+    def cancel(self):
+        """
+        Discards all queued data and stops the write in progress after its
+        current slice.
+        """
+        with self._cond:
+            self._generation += 1
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is self._close:
+                self._queue.put(item)
+                return
+            self._release(item[0])
+
+    def close(self):
+        """
+        Discards any unsent data and stops the writer thread.
+        """
+        self.cancel()
+        self._queue.put(self._close)
+        self._thread.join()
+
+    def _release(self, data):
+        with self._cond:
+            self.pending_bytes -= len(data)
+            self._cond.notify_all()
+
+    def _get(self):
+        """
+        Returns the next queued item with the generation it was taken in,
+        starting with any item `_next` held back.
+        """
+        if self._held is not None:
+            held, self._held = self._held, None
+            return held
+        item = self._queue.get()
+        with self._cond:
+            return item, self._generation
+
+    def _next(self):
+        """
+        Takes the next write from the queue and joins any small writes that
+        directly follow it with the same cancel event. Data discarded by
+        `cancel` or whose event is set is skipped.
+        """
+        while True:
+            item, generation = self._get()
+            if item is self._close:
+                return None, None, None
+            data, cancel = item
+            if generation != self._generation or \
+                    (cancel is not None and cancel.is_set()):
+                self._release(data)
+                continue
+            break
+        chunks = [data]
+        size = len(data)
+        while size < self.max_write:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._close or item[1] is not cancel:
+                # Hold it back for the next call, the queue can't be
+                # pushed back onto.
+                self._held = (item, generation)
+                break
+            chunks.append(item[0])
+            size += len(item[0])
+        if len(chunks) == 1:
+            return chunks[0], generation, cancel
+        return b''.join(chunks), generation, cancel
+
+    def _run(self):
+        while True:
+            data, generation, cancel = self._next()
+            if data is None:
+                return
+            view = memoryview(data)
+            for offset in range(0, len(view), self.max_write):
+                if generation != self._generation or \
+                        (cancel is not None and cancel.is_set()):
+                    # Cancelled, the remaining bytes are dropped.
+                    self._release(view[offset:])
+                    break
+                block = view[offset:offset + self.max_write]
+                try:
+                    self.serial.write(block)
+                    capture = self.capture
+                    if capture is not None:
+                        capture.record(TX, block)
+                    self.bytes_written += len(block)
+                    self.writes += 1
+                except (serial.SerialException, OSError, ValueError) as e:
+                    self.error = e
+                self._release(block)